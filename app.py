@@ -1,5 +1,3 @@
-import boto3
-from botocore.exceptions import ClientError
 from dotenv import load_dotenv
 import os
 import tempfile
@@ -17,8 +15,15 @@ import mailchimp_transactional as MailchimpTransactional
 from mailchimp_transactional.api_client import ApiClientError
 
 from db_connector import DatabaseConnector
+from db_pool import get_pool
 from report_generator import ReportGenerator
+from report_assets import preload_report_assets
+from output_profiles import PROFILES
+from data_exporter import CONTENT_TYPES, EXPORT_FORMATS, DataExporter
 from tax_cal import TaxCalculator  # 导入税额计算器
+from bill_builder import build_bill_data
+from report_cache import fingerprint_report, get_report_cache
+from storage import upload_to_s3
 
 load_dotenv()
 
@@ -35,49 +40,14 @@ MANDRILL_API_KEY = os.environ.get("MANDRILL_API_KEY")
 FROM_EMAIL = os.environ.get("FROM_EMAIL", "hello@zomi.menu")
 FROM_NAME = os.environ.get("FROM_NAME", "ZOMI Team")
 
-AWS_ACCESS_KEY = os.environ.get("AWS_ACCESS_KEY")
-AWS_SECRET_KEY = os.environ.get("AWS_SECRET_KEY")
-AWS_REGION = os.environ.get("AWS_REGION", "us-west-2")
-S3_BUCKET = os.environ.get("AWS_BUCKET_NAME", "zomi-transaction-reports")
+# /pool-stats/ 暴露连接池内部状态，默认关闭；只在 debug 模式或设置 POOL_STATS_ENABLED=1 时可用
+POOL_STATS_ENABLED = os.environ.get("POOL_STATS_ENABLED", "0") not in ("0", "false", "False", "")
 
 app = Flask(__name__)
 
+# 启动时加载字体、模板与坐标配置，每个请求的 ReportGenerator 直接复用
+preload_report_assets()
 
-# 添加上传函数
-def upload_to_s3(file_path, file_name=None):
-    """
-    将文件上传到 S3 并返回可访问的 URL
-    """
-    if not file_name:
-        file_name = os.path.basename(file_path)
-    
-    try:
-        s3_client = boto3.client(
-            's3',
-            aws_access_key_id=AWS_ACCESS_KEY,
-            aws_secret_access_key=AWS_SECRET_KEY,
-            region_name=AWS_REGION
-        )
-        
-        # 上传文件到 S3
-        s3_client.upload_file(
-            file_path,
-            S3_BUCKET,
-            file_name,
-            ExtraArgs={
-                'ContentType': 'application/pdf',
-                'ACL': 'public-read'  # 设置为公开可读
-            }
-        )
-        
-        # 构建并返回 URL
-        url = f"https://{S3_BUCKET}.s3.{AWS_REGION}.amazonaws.com/{file_name}"
-        logger.info(f"File uploaded to S3: {url}")
-        return url
-    
-    except Exception as e:
-        logger.error(f"Error uploading to S3: {str(e)}")
-        raise
 
 # 确保single_report文件夹存在
 def ensure_dir_exists(dir_path):
@@ -95,10 +65,77 @@ def open_file(filepath):
         subprocess.call(('xdg-open', filepath))
     logger.info(f"Opened file: {filepath}")
 
+def render_store_report(db, store_id, input_date, store_info, week_bill, profile, output_format="pdf"):
+    """统计订单、计算税额并生成周报 PDF 或数据导出文件，返回 (report_path, filename)"""
+    start_date = week_bill["start_date"]
+    end_date = week_bill["end_date"]
+
+    # 订单统计由数据库聚合，明细在生成报告时流式读取
+    order_stats = db.get_order_stats_by_store_and_period(store_id, start_date, end_date)
+    logger.info(f"Found {order_stats['total_orders']} orders in period {start_date.strftime('%Y-%m-%d')} to {end_date.strftime('%Y-%m-%d')}")
+
+    # 计算所有订单的PST总额
+    order_ids = db.get_order_ids_by_store_and_period(store_id, start_date, end_date)
+    tax_calculator = TaxCalculator()
+    tax_totals = tax_calculator.calculate_taxes(order_ids, as_of=start_date)
+    tax_calculator.close()
+
+    bill_data = build_bill_data(
+        week_bill, tax_totals, order_stats["total_orders"], order_stats["unique_users"]
+    )
+
+    # 创建固定目录用于存放生成的报告
+    single_report_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "single_report")
+    ensure_dir_exists(single_report_dir)
+
+    # 生成带时间戳的文件名
+    timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+    pdf_filename = f"{store_id}_{input_date.strftime('%Y%m%d')}_{timestamp}.{output_format}"
+    report_path = os.path.join(single_report_dir, pdf_filename)
+
+    orders = db.iter_orders_by_store_and_period(store_id, start_date, end_date)
+    if output_format in EXPORT_FORMATS:
+        # 只导出数据，不渲染页面
+        exporter = DataExporter(output_dir=os.path.dirname(report_path))
+        pdf_path = exporter.export(bill_data, store_info, orders, output_format)
+    else:
+        # 生成报告
+        report_gen = ReportGenerator(output_dir=os.path.dirname(report_path))
+        pdf_path = report_gen.generate_report(
+            bill_data, store_info, orders, order_count=order_stats["total_orders"], profile=profile
+        )
+
+    # 重命名文件到带时间戳的名称
+    if pdf_path != report_path:
+        # 如果生成的文件名与期望的不同，重命名它
+        if os.path.exists(report_path):
+            os.remove(report_path)  # 如果文件已存在，先删除
+        os.rename(pdf_path, report_path)
+        logger.info(f"Renamed report file to: {report_path}")
+    return report_path, pdf_filename
+
+
+def report_fingerprint(db, store_id, store_info, week_bill, profile, output_format="pdf"):
+    """报告缓存键：周账单、商户信息、订单与税目的聚合摘要、布局/模板版本与输出配置"""
+    order_digest = db.get_order_digest_by_store_and_period(
+        store_id, week_bill["start_date"], week_bill["end_date"]
+    )
+    return fingerprint_report(
+        week_bill, store_info, order_digest, profile=profile, output_format=output_format
+    )
+
+
 @app.route('/')
 def root():
     return {"message": "Transaction Report API is running"}
 
+@app.route('/pool-stats/')
+def pool_stats():
+    """当前 worker 进程的 MySQL 连接池状态"""
+    if not (POOL_STATS_ENABLED or app.debug):
+        return jsonify({"error": "Not found"}), 404
+    return jsonify({"pid": os.getpid(), **get_pool().stats()})
+
 @app.route('/generate-report/', methods=['POST'])
 def generate_report():
     try:
@@ -109,16 +146,24 @@ def generate_report():
             
         store_id = request_data.get('store_id')
         date_str = request_data.get('date')
+        # 输出配置：archival（默认）/ email / preview
+        profile = request_data.get('profile', 'archival')
+        # 输出格式：pdf（默认）或只导出数据 csv / json / xlsx
+        output_format = request_data.get('format', 'pdf')
         
         if not store_id or not date_str:
             return jsonify({"error": "Missing required parameters: store_id or date"}), 400
+        if profile not in PROFILES:
+            return jsonify({"error": f"Invalid profile. Use one of: {', '.join(PROFILES)}"}), 400
+        if output_format not in CONTENT_TYPES:
+            return jsonify({"error": f"Invalid format. Use one of: {', '.join(CONTENT_TYPES)}"}), 400
             
         try:
             input_date = datetime.datetime.strptime(date_str, "%Y-%m-%d")
         except ValueError:
             return jsonify({"error": "Invalid date format. Use YYYY-MM-DD"}), 400
 
-        logger.info(f"Generating report for store_id: {store_id}, date: {date_str}")
+        logger.info(f"Generating report for store_id: {store_id}, date: {date_str}, profile: {profile}")
         
         # 连接数据库
         db = DatabaseConnector()
@@ -142,94 +187,27 @@ def generate_report():
         end_date = week_bill["end_date"]
         logger.info(f"Found weekly bill from {start_date.strftime('%Y-%m-%d')} to {end_date.strftime('%Y-%m-%d')}")
         
-        # 查询该周期内的所有订单
-        orders = db.get_orders_by_store_and_period(store_id, start_date, end_date)
-        logger.info(f"Found {len(orders)} orders in period {start_date.strftime('%Y-%m-%d')} to {end_date.strftime('%Y-%m-%d')}")
-
-        # 填充每个订单的 user_name
-        for order in orders:
-            order["user_name"] = db.get_user_profile(order["user_id"])
-        
-        # 计算所有订单的PST总额
-        order_ids = [order.get("id") for order in orders if order.get("id")]
-        tax_calculator = TaxCalculator()
-        tax_totals = tax_calculator.calculate_taxes(order_ids)
-        tax_calculator.close()
-        
-        # 从周账单中获取数据，使用Decimal确保精度
-        total_orders = len(orders)
-        
-        # 确保所有金额使用Decimal
-        original_price = Decimal(str(week_bill.get("original_price", 0)))
-        GST = Decimal(str(week_bill.get("product_tax_fee", 0)))
-        PST_total = Decimal(str(tax_totals["PST_total"]))
-        GST_total = GST - PST_total  # 使用Decimal计算
-        
-        # 计算Additional_charge
-        commission_fee = Decimal(str(week_bill.get("commission_fee", 0)))
-        refund_commission_fee = Decimal(str(week_bill.get("refund_commission_fee", 0)))
-        asset_balance_repayment = Decimal(str(week_bill.get("asset_balance_repayment", 0)))
-        extra_fee = Decimal(str(week_bill.get("extra_fee", 0)))
-        
-        # 计算Additional_charge, 为负数
-        additional_charge = -(
-            commission_fee
-            - refund_commission_fee
-            + asset_balance_repayment
-            - extra_fee
-        )
-        
-        # 构建bill_data
-        bill_data = {
-            "start_date": start_date,
-            "end_date": end_date,
-            "store_amount": Decimal(str(week_bill.get("store_amount", 0))),
-            "original_price": original_price,
-            "discount_fee": Decimal(str(week_bill.get("discount_fee", 0))),
-            "refund_amount": Decimal(str(week_bill.get("refund_amount", 0))),
-            "pickup_tip_fee": Decimal(str(week_bill.get("pickup_tip_fee", 0))),
-            "product_tax_fee": GST,
-            "commission_fee": commission_fee,
-            "refund_commission_fee": refund_commission_fee,
-            "asset_balance_repayment": asset_balance_repayment,
-            "extra_fee": extra_fee,
-            "total_orders": total_orders,
-            "total_revenue": original_price - Decimal(str(week_bill.get("discount_fee", 0))) - Decimal(str(week_bill.get("refund_amount", 0))),
-            "unique_users": len(set(order["user_id"] for order in orders)),
-            "GST": GST,
-            "GST_total": GST_total,
-            "PST_total": PST_total,
-            "Additional_charge": additional_charge
-        }
+        # 相同的周账单与订单已生成并上传过时直接返回已有的 URL；refresh 为 true 时强制重新生成
+        report_cache = get_report_cache()
+        fingerprint = report_fingerprint(db, store_id, store_info, week_bill, profile, output_format)
+        cached = None if request_data.get('refresh') else report_cache.get(fingerprint)
+        if cached and cached.get("url"):
+            db.close()
+            return jsonify({
+                "code": 0,
+                "data": {
+                    "url": cached["url"]
+                }
+            })
 
-        # 其他周账单数据
-        for key in ["stripe_fee", "remark"]:
-            if key in week_bill:
-                if isinstance(week_bill[key], (int, float)):
-                    bill_data[key] = Decimal(str(week_bill[key]))
-                else:
-                    bill_data[key] = week_bill[key]
-
-        # 创建固定目录用于存放生成的报告
-        single_report_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "single_report")
-        ensure_dir_exists(single_report_dir)
-        
-        # 生成带时间戳的文件名
-        timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-        pdf_filename = f"{store_id}_{input_date.strftime('%Y%m%d')}_{timestamp}.pdf"
-        report_path = os.path.join(single_report_dir, pdf_filename)
-        
-        # 生成报告
-        report_gen = ReportGenerator(output_dir=os.path.dirname(report_path))
-        pdf_path = report_gen.generate_report(bill_data, store_info, orders)
-        
-        # 重命名文件到带时间戳的名称
-        if pdf_path != report_path:
-            # 如果生成的文件名与期望的不同，重命名它
-            if os.path.exists(report_path):
-                os.remove(report_path)  # 如果文件已存在，先删除
-            os.rename(pdf_path, report_path)
-            logger.info(f"Renamed report file to: {report_path}")
+        if cached:
+            # 只有本地文件（例如由邮件接口生成），跳过渲染直接上传
+            report_path = cached["path"]
+            pdf_filename = os.path.basename(report_path)
+        else:
+            report_path, pdf_filename = render_store_report(
+                db, store_id, input_date, store_info, week_bill, profile, output_format
+            )
         
         # 自动打开生成的文件
         # try:
@@ -240,7 +218,10 @@ def generate_report():
         db.close()
         
         try:
-            s3_url = upload_to_s3(report_path, pdf_filename)
+            s3_url = upload_to_s3(report_path, pdf_filename, CONTENT_TYPES[output_format])
+            report_cache.put(
+                fingerprint, path=report_path, url=s3_url, store_id=store_id, start_date=start_date
+            )
             # 按照要求的格式返回 URL
             return jsonify({
                 "code": 0,
@@ -276,16 +257,24 @@ def generate_and_email_report():
             
         store_id = request_data.get('store_id')
         date_str = request_data.get('date')
+        # 邮件附件默认使用 email 配置，减小 base64 后的 Mandrill 请求体
+        profile = request_data.get('profile', 'email')
+        # 输出格式：pdf（默认）或只导出数据 csv / json / xlsx
+        output_format = request_data.get('format', 'pdf')
         
         if not store_id or not date_str:
             return jsonify({"error": "Missing required parameters: store_id or date"}), 400
+        if profile not in PROFILES:
+            return jsonify({"error": f"Invalid profile. Use one of: {', '.join(PROFILES)}"}), 400
+        if output_format not in CONTENT_TYPES:
+            return jsonify({"error": f"Invalid format. Use one of: {', '.join(CONTENT_TYPES)}"}), 400
             
         try:
             input_date = datetime.datetime.strptime(date_str, "%Y-%m-%d")
         except ValueError:
             return jsonify({"error": "Invalid date format. Use YYYY-MM-DD"}), 400
 
-        logger.info(f"Generating report and sending email for store_id: {store_id}, date: {date_str}")
+        logger.info(f"Generating report and sending email for store_id: {store_id}, date: {date_str}, profile: {profile}")
         
         # 连接数据库
         db = DatabaseConnector()
@@ -315,94 +304,18 @@ def generate_and_email_report():
         end_date = week_bill["end_date"]
         logger.info(f"Found weekly bill from {start_date.strftime('%Y-%m-%d')} to {end_date.strftime('%Y-%m-%d')}")
         
-        # 查询该周期内的所有订单
-        orders = db.get_orders_by_store_and_period(store_id, start_date, end_date)
-        logger.info(f"Found {len(orders)} orders in period {start_date.strftime('%Y-%m-%d')} to {end_date.strftime('%Y-%m-%d')}")
-
-        # 填充每个订单的 user_name
-        for order in orders:
-            order["user_name"] = db.get_user_profile(order["user_id"])
-        
-        # 计算所有订单的PST总额
-        order_ids = [order.get("id") for order in orders if order.get("id")]
-        tax_calculator = TaxCalculator()
-        tax_totals = tax_calculator.calculate_taxes(order_ids)
-        tax_calculator.close()
-        
-        # 从周账单中获取数据，使用Decimal确保精度
-        total_orders = len(orders)
-        
-        # 确保所有金额使用Decimal
-        original_price = Decimal(str(week_bill.get("original_price", 0)))
-        GST = Decimal(str(week_bill.get("product_tax_fee", 0)))
-        PST_total = Decimal(str(tax_totals["PST_total"]))
-        GST_total = GST - PST_total  # 使用Decimal计算
-        
-        # 计算Additional_charge
-        commission_fee = Decimal(str(week_bill.get("commission_fee", 0)))
-        refund_commission_fee = Decimal(str(week_bill.get("refund_commission_fee", 0)))
-        asset_balance_repayment = Decimal(str(week_bill.get("asset_balance_repayment", 0)))
-        extra_fee = Decimal(str(week_bill.get("extra_fee", 0)))
-        
-        # 计算Additional_charge, 为负数
-        additional_charge = -(
-            commission_fee
-            - refund_commission_fee
-            + asset_balance_repayment
-            - extra_fee
-        )
-        
-        # 构建bill_data
-        bill_data = {
-            "start_date": start_date,
-            "end_date": end_date,
-            "store_amount": Decimal(str(week_bill.get("store_amount", 0))),
-            "original_price": original_price,
-            "discount_fee": Decimal(str(week_bill.get("discount_fee", 0))),
-            "refund_amount": Decimal(str(week_bill.get("refund_amount", 0))),
-            "product_tax_fee": GST,
-            "pickup_tip_fee": Decimal(str(week_bill.get("pickup_tip_fee", 0))),
-            "commission_fee": commission_fee,
-            "refund_commission_fee": refund_commission_fee,
-            "asset_balance_repayment": asset_balance_repayment,
-            "extra_fee": extra_fee,
-            "total_orders": total_orders,
-            "total_revenue": original_price - Decimal(str(week_bill.get("discount_fee", 0))) - Decimal(str(week_bill.get("refund_amount", 0))),
-            "unique_users": len(set(order["user_id"] for order in orders)),
-            "GST": GST,
-            "GST_total": GST_total,
-            "PST_total": PST_total,
-            "Additional_charge": additional_charge
-        }
-
-        # 其他周账单数据
-        for key in ["stripe_fee", "remark"]:
-            if key in week_bill:
-                if isinstance(week_bill[key], (int, float)):
-                    bill_data[key] = Decimal(str(week_bill[key]))
-                else:
-                    bill_data[key] = week_bill[key]
-
-        # 创建固定目录用于存放生成的报告
-        single_report_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "single_report")
-        ensure_dir_exists(single_report_dir)
-        
-        # 生成带时间戳的文件名
-        timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-        pdf_filename = f"{store_id}_{input_date.strftime('%Y%m%d')}_{timestamp}.pdf"
-        report_path = os.path.join(single_report_dir, pdf_filename)
-        
-        # 生成报告
-        report_gen = ReportGenerator(output_dir=os.path.dirname(report_path))
-        pdf_path = report_gen.generate_report(bill_data, store_info, orders)
-        
-        # 重命名文件到带时间戳的名称
-        if pdf_path != report_path:
-            # 如果生成的文件名与期望的不同，重命名它
-            if os.path.exists(report_path):
-                os.remove(report_path)  # 如果文件已存在，先删除
-            os.rename(pdf_path, report_path)
-            logger.info(f"Renamed report file to: {report_path}")
+        # 相同的周账单与订单已生成过时直接复用本地 PDF；refresh 为 true 时强制重新生成
+        report_cache = get_report_cache()
+        fingerprint = report_fingerprint(db, store_id, store_info, week_bill, profile, output_format)
+        cached = None if request_data.get('refresh') else report_cache.get(fingerprint, require_file=True)
+        if cached:
+            report_path = cached["path"]
+            pdf_filename = os.path.basename(report_path)
+        else:
+            report_path, pdf_filename = render_store_report(
+                db, store_id, input_date, store_info, week_bill, profile, output_format
+            )
+            report_cache.put(fingerprint, path=report_path, store_id=store_id, start_date=start_date)
         
         # 读取PDF文件并编码为base64
         with open(report_path, 'rb') as f:
@@ -431,7 +344,7 @@ def generate_and_email_report():
             # 添加报告作为附件
             "attachments": [
                 {
-                    "type": "application/pdf",
+                    "type": CONTENT_TYPES[output_format],
                     "name": pdf_filename,
                     "content": pdf_base64,
                 }
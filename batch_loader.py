@@ -0,0 +1,64 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+# 每次预取的账单数量：越大查询越少，但块内订单在逐个产出前全部驻留内存
+DEFAULT_CHUNK_SIZE = 200
+
+
+class BatchDataLoader:
+    """Prefetch stores, contacts, orders, user names and taxes for many bills with set-based queries"""
+
+    def __init__(self, db, tax_calculator, chunk_size=DEFAULT_CHUNK_SIZE):
+        self.db = db
+        self.tax_calculator = tax_calculator
+        # 每次预取的账单数量，限制单次驻留内存
+        self.chunk_size = chunk_size
+
+    def iter_bundles(self, bills):
+        """Yield one ready-made bundle per bill, in the order of `bills`"""
+        # 整批账单的税额由一次分组查询得到
+        tax_totals = self.tax_calculator.calculate_taxes_for_bills(bills)
+        for i in range(0, len(bills), self.chunk_size):
+            yield from self._load_chunk(bills[i:i + self.chunk_size], tax_totals)
+
+    def _load_chunk(self, bills, tax_totals):
+        store_ids = [bill["store_id"] for bill in bills]
+        stores = self.db.get_stores_info(store_ids)
+        contacts = self.db.get_store_contact_emails(store_ids)
+
+        # 周账单大多共享同一个起止日期，同一周期的商店合并为一次查询
+        windows = {}
+        for bill in bills:
+            windows.setdefault((bill["start_date"], bill["end_date"]), []).append(bill["store_id"])
+
+        orders_by_bill = {}
+        for (start_date, end_date), window_store_ids in windows.items():
+            orders_by_store = self.db.get_orders_by_stores_and_period(
+                window_store_ids, start_date, end_date
+            )
+            for store_id in window_store_ids:
+                orders_by_bill[(store_id, start_date, end_date)] = orders_by_store.get(store_id, [])
+
+        user_names = self.db.get_user_profiles(
+            order.user_id for orders in orders_by_bill.values() for order in orders
+        )
+        for orders in orders_by_bill.values():
+            for order in orders:
+                order.user_name = user_names.get(order.user_id, "")
+
+        logger.info(
+            f"Prefetched {len(bills)} bills: {len(stores)} stores, "
+            f"{sum(len(orders) for orders in orders_by_bill.values())} orders, "
+            f"{len(user_names)} users"
+        )
+
+        for bill in bills:
+            key = (bill["store_id"], bill["start_date"], bill["end_date"])
+            yield {
+                "bill": bill,
+                "store_info": stores.get(bill["store_id"]),
+                "contact_email": contacts.get(bill["store_id"]),
+                "orders": orders_by_bill[key],
+                "tax_totals": tax_totals[key],
+            }
@@ -0,0 +1,288 @@
+import os
+import time
+import queue
+import logging
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from db_connector import DatabaseConnector
+from tax_cal import TaxCalculator
+from batch_loader import DEFAULT_CHUNK_SIZE, BatchDataLoader
+from bill_builder import build_bill_data
+from data_exporter import CONTENT_TYPES, EXPORT_FORMATS, DataExporter
+from report_generator import ReportGenerator, process_pool_context
+
+logger = logging.getLogger(__name__)
+
+# 队列结束标记
+_DONE = object()
+# 每个预取线程同时占用的连接数：DatabaseConnector 与 TaxCalculator 各一个
+PREFETCH_CONNECTIONS = 2
+
+
+def report_writer(output_dir, output_format):
+    """按输出格式返回 write(bill_data, store_info, orders, order_count=None) -> 文件路径"""
+    if output_format in EXPORT_FORMATS:
+        exporter = DataExporter(output_dir=output_dir)
+
+        def write(bill_data, store_info, orders, order_count=None):
+            return exporter.export(bill_data, store_info, orders, output_format)
+
+        return write
+    return ReportGenerator(output_dir=output_dir).generate_report
+
+
+def failed_result(bill, error, store_info=None):
+    return {
+        "store_id": bill["store_id"],
+        "store_name": store_info["name"] if store_info else None,
+        "report_path": None,
+        "error": error,
+        "elapsed": 0.0,
+    }
+
+
+def process_bundle(bundle, write):
+    """Render one prefetched bill, returning its result instead of raising so one bad bill does not stop the batch"""
+    started = time.perf_counter()
+    bill = bundle["bill"]
+    store_info = bundle["store_info"]
+    result = failed_result(bill, None, store_info)
+    logger.info(f"Processing bill for store_id: {bill['store_id']}")
+    if not store_info:
+        logger.warning(f"Store info not found for store_id: {bill['store_id']}")
+        result["error"] = "Store info not found"
+    else:
+        try:
+            orders = bundle["orders"]
+            logger.info(f"Found {len(orders)} orders for {store_info['name']}")
+
+            # 与单报告模式相同的 bill_data，金额使用Decimal
+            bill_data = build_bill_data(
+                bill,
+                bundle["tax_totals"],
+                len(orders),
+                len(set(order.user_id for order in orders)),
+            )
+
+            # Generate report
+            result["report_path"] = write(bill_data, store_info, orders)
+            logger.info(f"Generated report: {result['report_path']}")
+        except Exception as e:
+            logger.error(f"Error generating report for store_id {bill['store_id']}: {e}", exc_info=True)
+            result["error"] = str(e)
+    result["elapsed"] = time.perf_counter() - started
+    return result
+
+
+def write_summary(batch_dir, batch_timestamp, results, elapsed, filename="summary.txt"):
+    """Create a summary file with links to all generated reports, plus failures and timings"""
+    successful_reports = [result for result in results if not result["error"]]
+    failed_reports = [result for result in results if result["error"]]
+    summary_path = os.path.join(batch_dir, filename)
+    os.makedirs(batch_dir, exist_ok=True)
+    with open(summary_path, "w") as f:
+        f.write(f"Report Generation Summary - {batch_timestamp}\n")
+        f.write(f"Total reports generated: {len(successful_reports)}\n")
+        f.write(f"Failed: {len(failed_reports)}\n")
+        f.write(f"Elapsed: {elapsed:.1f}s\n\n")
+
+        for idx, report in enumerate(successful_reports, 1):
+            f.write(f"{idx}. {report['store_name']} (ID: {report['store_id']})\n")
+            f.write(f"   Path: {report['report_path']}\n")
+            if report.get("url"):
+                f.write(f"   URL: {report['url']}\n")
+            f.write(f"   Time: {report['elapsed']:.2f}s\n\n")
+
+        if failed_reports:
+            f.write("Failed reports:\n")
+            for report in failed_reports:
+                f.write(f"- {report['store_name'] or ''} (ID: {report['store_id']}): {report['error']}\n")
+    return summary_path
+
+
+# 渲染进程内的输出函数，由 _init_render_worker 在每个进程创建一次
+_render_write = None
+
+
+def _init_render_worker(batch_dir, output_format):
+    """渲染进程初始化：预加载字体模板并创建 ReportGenerator / DataExporter，渲染进程不连接数据库"""
+    global _render_write
+    _render_write = report_writer(batch_dir, output_format)
+
+
+def _render_bundle_in_worker(bundle):
+    return process_bundle(bundle, _render_write)
+
+
+class BatchPipeline:
+    """Batch generation as three overlapped stages joined by bounded queues
+
+    prefetch：prefetch_workers 个线程，各自持有数据库连接，按 chunk_size 个账单批量预取；
+    render：render_workers 个渲染进程（CPU 密集），每个由一个线程分发任务并等待结果；
+    output：output_workers 个线程，上传 S3（upload=True 时）、写入 manifest 并汇总结果。
+    队列满时上游阻塞，渲染跟不上时每个预取线程最多驻留一块（chunk_size 个账单）的数据，外加队列中的 queue_size 个。
+    """
+
+    def __init__(
+        self,
+        batch_dir,
+        output_format="pdf",
+        prefetch_workers=1,
+        render_workers=1,
+        output_workers=2,
+        queue_size=None,
+        chunk_size=None,
+        upload=False,
+        manifest=None,
+    ):
+        self.batch_dir = batch_dir
+        self.output_format = output_format
+        self.prefetch_workers = max(1, prefetch_workers)
+        self.render_workers = max(1, render_workers)
+        self.output_workers = max(1, output_workers)
+        # 默认每个渲染进程前面排两个账单，保证渲染不空等
+        self.queue_size = queue_size or 2 * self.render_workers
+        # 数据库批量大小与队列上限无关：每块账单只做一组批量查询（含一次税额扫描），
+        # 队列满时 iter_bundles 在 put 处阻塞，由有界队列提供背压
+        self.chunk_size = chunk_size or DEFAULT_CHUNK_SIZE
+        # 只有上传时才需要 boto3
+        self._upload_to_s3 = None
+        if upload:
+            from storage import upload_to_s3
+            self._upload_to_s3 = upload_to_s3
+
+        # RunManifest，每个账单完成后立即记录，中断后可 --resume
+        self.manifest = manifest
+
+        self._render_queue = queue.Queue(maxsize=self.queue_size)
+        self._output_queue = queue.Queue(maxsize=self.queue_size)
+        self._results = {}
+        self._results_lock = threading.Lock()
+        self._stage_errors = []
+
+    def run(self, bills):
+        """Process every bill and return the results in the order of `bills`"""
+        self._bills = bills
+        if self.manifest is not None:
+            self.manifest.mark_pending(bills)
+        indexed = list(enumerate(bills))
+        chunks = queue.Queue()
+        for i in range(0, len(indexed), self.chunk_size):
+            chunks.put(indexed[i:i + self.chunk_size])
+
+        # 阶段线程启动后才会创建渲染进程，不能用 fork，见 process_pool_context
+        with ProcessPoolExecutor(
+            max_workers=self.render_workers,
+            mp_context=process_pool_context(),
+            initializer=_init_render_worker,
+            initargs=(self.batch_dir, self.output_format),
+        ) as executor:
+            prefetchers = self._start(self.prefetch_workers, "prefetch", self._prefetch_stage, chunks)
+            renderers = self._start(self.render_workers, "render", self._render_stage, executor)
+            outputs = self._start(self.output_workers, "output", self._output_stage)
+
+            # 上游线程全部结束后，向下游每个线程发送一个结束标记
+            self._join(prefetchers, self._render_queue, len(renderers))
+            self._join(renderers, self._output_queue, len(outputs))
+            for thread in outputs:
+                thread.join()
+
+        if self._stage_errors:
+            # 已完成的账单照常返回；所有预取线程都失败时剩下的账单没有结果，记为失败，manifest 中仍为 pending
+            logger.error(f"{len(self._stage_errors)} batch pipeline stage thread(s) failed, see errors above")
+        error = f"Not processed: {self._stage_errors[0]}" if self._stage_errors else "Not processed"
+        return [
+            self._results[idx] if idx in self._results else failed_result(bill, error)
+            for idx, bill in enumerate(bills)
+        ]
+
+    def _start(self, count, name, target, *args):
+        threads = []
+        for i in range(count):
+            thread = threading.Thread(
+                target=self._guard, args=(target,) + args, name=f"batch-{name}-{i}", daemon=True
+            )
+            thread.start()
+            threads.append(thread)
+        return threads
+
+    def _guard(self, target, *args):
+        # 阶段线程内的意外异常记录下来，run() 在流水线排空后把未处理的账单记为失败
+        try:
+            target(*args)
+        except BaseException as e:
+            logger.error(f"Batch pipeline stage failed: {e}", exc_info=True)
+            self._stage_errors.append(e)
+
+    def _join(self, threads, downstream, consumers):
+        for thread in threads:
+            thread.join()
+        for _ in range(consumers):
+            downstream.put(_DONE)
+
+    def _prefetch_stage(self, chunks):
+        db = tax_calculator = None
+        try:
+            db = DatabaseConnector()
+            tax_calculator = TaxCalculator()
+            loader = BatchDataLoader(db, tax_calculator, chunk_size=self.chunk_size)
+            while True:
+                try:
+                    chunk = chunks.get_nowait()
+                except queue.Empty:
+                    return
+                queued = set()
+                try:
+                    bundles = loader.iter_bundles([bill for _, bill in chunk])
+                    for (idx, _), bundle in zip(chunk, bundles):
+                        # 渲染队列满时在此阻塞
+                        self._render_queue.put((idx, bundle))
+                        queued.add(idx)
+                except Exception as e:
+                    # 预取失败：这一块中尚未进入渲染队列的账单记为失败
+                    logger.error(f"Prefetch failed for {len(chunk)} bills: {e}", exc_info=True)
+                    for idx, bill in chunk:
+                        if idx not in queued:
+                            self._output_queue.put((idx, failed_result(bill, str(e))))
+        finally:
+            if tax_calculator is not None:
+                tax_calculator.close()
+            if db is not None:
+                db.close()
+
+    def _render_stage(self, executor):
+        while True:
+            item = self._render_queue.get()
+            if item is _DONE:
+                return
+            idx, bundle = item
+            try:
+                result = executor.submit(_render_bundle_in_worker, bundle).result()
+            except Exception as e:
+                # 渲染进程异常退出
+                logger.error(f"Render worker failed for store_id {bundle['bill']['store_id']}: {e}", exc_info=True)
+                result = failed_result(bundle["bill"], str(e), bundle["store_info"])
+            self._output_queue.put((idx, result))
+
+    def _output_stage(self):
+        while True:
+            item = self._output_queue.get()
+            if item is _DONE:
+                return
+            idx, result = item
+            if self._upload_to_s3 is not None and result["report_path"]:
+                started = time.perf_counter()
+                try:
+                    result["url"] = self._upload_to_s3(
+                        result["report_path"], content_type=CONTENT_TYPES[self.output_format]
+                    )
+                except Exception as e:
+                    result["error"] = f"Upload failed: {e}"
+                result["elapsed"] += time.perf_counter() - started
+            if self.manifest is not None:
+                self.manifest.record(self._bills[idx], result)
+            with self._results_lock:
+                self._results[idx] = result
+                done = len(self._results)
+            logger.info(f"Finished {done} bills")
@@ -0,0 +1,91 @@
+import math
+import hashlib
+import logging
+from collections import namedtuple
+
+from report_generator import ORDERS_PER_PAGE, has_additional_charges
+from run_manifest import bill_key
+
+logger = logging.getLogger(__name__)
+
+# 概览页，额外费用页只在有额外费用时生成
+OVERVIEW_PAGES = 1
+# --plan 报告中列出的最大账单数
+PLAN_TOP_BILLS = 20
+
+# 一个账单的预估：订单数来自 COUNT(*)，页数决定渲染耗时
+BillPlan = namedtuple("BillPlan", ["bill", "order_count", "pages"])
+
+
+def estimate_pages(bill, order_count):
+    """Expected page count of a report: overview and detail pages, plus the additional page when the bill has one"""
+    # 与 ReportGenerator 相同的判断，周账单行与 bill_data 的额外费用字段同名
+    additional = 1 if has_additional_charges(bill) else 0
+    return OVERVIEW_PAGES + math.ceil(order_count / ORDERS_PER_PAGE) + additional
+
+
+def stable_hash(bill):
+    """Hash of the bill key that is the same on every node and Python process (unlike hash())"""
+    return int.from_bytes(hashlib.sha256(bill_key(bill).encode()).digest()[:8], "big")
+
+
+def plan_bills(db, bills):
+    """Estimate every bill's page count with grouped COUNT(*) queries, in the order of `bills`"""
+    windows = {}
+    for bill in bills:
+        windows.setdefault((bill["start_date"], bill["end_date"]), []).append(bill["store_id"])
+    counts = {}
+    for (start_date, end_date), store_ids in windows.items():
+        for store_id, count in db.get_order_counts_by_stores_and_period(store_ids, start_date, end_date).items():
+            counts[(store_id, start_date, end_date)] = count
+    plans = []
+    for bill in bills:
+        order_count = counts[(bill["store_id"], bill["start_date"], bill["end_date"])]
+        plans.append(BillPlan(bill, order_count, estimate_pages(bill, order_count)))
+    logger.info(
+        f"Planned {len(plans)} bills: {sum(plan.order_count for plan in plans)} orders, "
+        f"{sum(plan.pages for plan in plans)} estimated pages"
+    )
+    return plans
+
+
+def dispatch_order(plans):
+    """Indices of plans, largest first (ties by stable_hash), so no giant store is left for the end of the batch"""
+    return sorted(range(len(plans)), key=lambda idx: (-plans[idx].pages, stable_hash(plans[idx].bill)))
+
+
+def simulate_makespan(pages, workers):
+    """Pages rendered by the busiest worker when each job goes to the next free worker in the given order"""
+    loads = [0] * max(1, workers)
+    for job in pages:
+        loads[loads.index(min(loads))] += job
+    return max(loads)
+
+
+def format_plan(plans, workers, skipped=0):
+    """Text report for --plan: totals, estimated makespan by dispatch order and the largest bills"""
+    pages = [plan.pages for plan in plans]
+    total_pages = sum(pages)
+    lines = [
+        f"Batch plan: {len(plans)} bills, {sum(plan.order_count for plan in plans)} orders, "
+        f"{total_pages} estimated pages",
+    ]
+    if skipped:
+        lines.append(f"Skipped {skipped} bills completed in an earlier run")
+    if plans:
+        # 下界：总页数平均分给各 worker，且不少于最大的单个账单
+        lower_bound = max(math.ceil(total_pages / workers), max(pages))
+        largest_first = simulate_makespan([pages[idx] for idx in dispatch_order(plans)], workers)
+        lines += [
+            f"Workers: {workers}",
+            f"Estimated makespan in pages: largest first {largest_first}, "
+            f"database order {simulate_makespan(pages, workers)}, lower bound {lower_bound}",
+            "",
+            "Largest bills (dispatched first):",
+            f"{'store_id':>10}  {'period':<23}  {'orders':>8}  {'pages':>6}",
+        ]
+        for idx in dispatch_order(plans)[:PLAN_TOP_BILLS]:
+            plan = plans[idx]
+            period = f"{plan.bill['start_date']:%Y-%m-%d} - {plan.bill['end_date']:%Y-%m-%d}"
+            lines.append(f"{plan.bill['store_id']:>10}  {period:<23}  {plan.order_count:>8}  {plan.pages:>6}")
+    return "\n".join(lines)
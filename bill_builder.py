@@ -0,0 +1,60 @@
+from decimal import Decimal
+
+
+def build_bill_data(week_bill, tax_totals, total_orders, unique_users):
+    """根据周账单、税额与订单统计构建报表所需的 bill_data，所有金额使用Decimal"""
+    start_date = week_bill["start_date"]
+    end_date = week_bill["end_date"]
+
+    # 确保所有金额使用Decimal
+    original_price = Decimal(str(week_bill.get("original_price", 0)))
+    GST = Decimal(str(week_bill.get("product_tax_fee", 0)))
+    PST_total = Decimal(str(tax_totals["PST_total"]))
+    GST_total = GST - PST_total  # 使用Decimal计算
+
+    # 计算Additional_charge
+    commission_fee = Decimal(str(week_bill.get("commission_fee", 0)))
+    refund_commission_fee = Decimal(str(week_bill.get("refund_commission_fee", 0)))
+    asset_balance_repayment = Decimal(str(week_bill.get("asset_balance_repayment", 0)))
+    extra_fee = Decimal(str(week_bill.get("extra_fee", 0)))
+
+    # 计算Additional_charge, 为负数
+    additional_charge = -(
+        commission_fee
+        - refund_commission_fee
+        + asset_balance_repayment
+        - extra_fee
+    )
+
+    # 构建bill_data
+    bill_data = {
+        "start_date": start_date,
+        "end_date": end_date,
+        "store_amount": Decimal(str(week_bill.get("store_amount", 0))),
+        "original_price": original_price,
+        "discount_fee": Decimal(str(week_bill.get("discount_fee", 0))),
+        "refund_amount": Decimal(str(week_bill.get("refund_amount", 0))),
+        "pickup_tip_fee": Decimal(str(week_bill.get("pickup_tip_fee", 0))),
+        "product_tax_fee": GST,  # 这是原始 GST
+        "commission_fee": commission_fee,
+        "refund_commission_fee": refund_commission_fee,
+        "asset_balance_repayment": asset_balance_repayment,  # 这是原始服务包费用，避免转账和报表发生的服务费不一致
+        "extra_fee": extra_fee,
+        "total_orders": total_orders,
+        "total_revenue": original_price - Decimal(str(week_bill.get("discount_fee", 0))) - Decimal(str(week_bill.get("refund_amount", 0))),
+        "unique_users": unique_users,
+        "GST": GST,  # 设置从周账单中获取的 GST
+        "GST_total": GST_total,  # 设置为 GST - PST_total
+        "PST_total": PST_total,  # 从订单计算的 PST_total
+        "Additional_charge": additional_charge,
+    }
+
+    # 其他周账单数据，使用Decimal转换数值
+    for key in ["stripe_fee", "remark"]:
+        if key in week_bill:
+            if isinstance(week_bill[key], (int, float)):
+                bill_data[key] = Decimal(str(week_bill[key]))
+            else:
+                bill_data[key] = week_bill[key]
+
+    return bill_data
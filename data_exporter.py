@@ -0,0 +1,199 @@
+import os
+import csv
+import json
+import logging
+from decimal import Decimal
+
+from order_record import as_order_records
+from pdf_writer import atomic_output
+from report_generator import (
+    PAYMENT_METHOD_MAP,
+    additional_charge_values,
+    order_final_price,
+    overview_values,
+    time_period_text,
+)
+
+logger = logging.getLogger(__name__)
+
+# 数据导出格式；pdf 仍由 ReportGenerator 生成
+EXPORT_FORMATS = ("csv", "json", "xlsx")
+CONTENT_TYPES = {
+    "pdf": "application/pdf",
+    "csv": "text/csv",
+    "json": "application/json",
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+}
+
+# 与模板上的标题一致
+OVERVIEW_LABELS = {
+    "store_amount": "Net income",
+    "total_orders": "Orders",
+    "total_revenue": "Sales",
+    "pickup_tip_fee": "Tips",
+    "stripe_fee": "Transaction Fee",
+    "unique_users": "Customers",
+    "GST": "Tax total",
+    "Additional_charge": "Additional Charge",
+    "GST_total": "GST",
+    "PST_total": "PST",
+}
+ORDER_HEADERS = ("Order ID", "Payment method", "Customer name", "Balance", "Status", "Date")
+ADDITIONAL_HEADERS = ("Description", "Charge", "Date")
+
+
+def _money(value):
+    return Decimal(str(value)).quantize(Decimal("0.01"))
+
+
+def overview_rows(bill_data):
+    """[(label, value)]，金额保留两位小数，订单数/顾客数为整数"""
+    rows = []
+    for key, value, _ in overview_values(bill_data):
+        if key in ("total_orders", "unique_users"):
+            rows.append((OVERVIEW_LABELS[key], int(value)))
+        else:
+            rows.append((OVERVIEW_LABELS[key], _money(value)))
+    return rows
+
+
+def additional_charge_rows(bill_data):
+    return [(name, _money(amount), date_text) for _, name, amount, date_text in additional_charge_values(bill_data)]
+
+
+def order_row(order):
+    """One detail row in ORDER_HEADERS order, balance as a number"""
+    final_price, status_text = order_final_price(order)
+    pay_value = order.payment_method
+    pay_text = PAYMENT_METHOD_MAP.get(pay_value, "") if (pay_value is not None) else ""
+    return (
+        str(order.pickup_code),
+        pay_text,
+        str(order.user_name or ""),
+        _money(final_price),
+        status_text,
+        order.created_at.strftime("%Y-%m-%d"),
+    )
+
+
+class DataExporter:
+    """Write the numbers a report shows (overview, additional charges, order rows) as CSV / JSON / XLSX
+
+    与 ReportGenerator 使用同一份 bill_data 和过滤后的 OrderRecord，不做任何栅格化；
+    orders 可以是流式迭代器，逐行写出。
+    """
+
+    def __init__(self, output_dir):
+        self.output_dir = output_dir
+        self.export_dir = os.path.join(output_dir, "data_exports")
+        os.makedirs(self.export_dir, exist_ok=True)
+
+    def export(self, bill_data, store_info, orders, fmt):
+        """Write one export file and return its path"""
+        if fmt not in EXPORT_FORMATS:
+            raise ValueError(f"Unknown export format {fmt!r}, expected one of {EXPORT_FORMATS}")
+        writer = getattr(self, f"_write_{fmt}")
+        if fmt == "xlsx":
+            # 先检查依赖，避免生成空文件
+            _load_openpyxl()
+
+        report_id = f"report_{store_info['id']}_{bill_data['start_date'].strftime('%Y%m%d')}"
+        path = os.path.join(self.export_dir, f"{report_id}.{fmt}")
+        orders = as_order_records(orders)
+        with atomic_output(path) as tmp_path:
+            count = writer(tmp_path, bill_data, store_info, orders)
+        logger.info(f"Exported {count} orders to {path}")
+        return path
+
+    def _header_rows(self, bill_data, store_info):
+        return [
+            ("Store", store_info["name"]),
+            ("Store ID", store_info["id"]),
+            ("Address", store_info.get("address", "")),
+            ("Period", time_period_text(bill_data)),
+        ]
+
+    def _write_csv(self, path, bill_data, store_info, orders):
+        count = 0
+        with open(path, "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerows(self._header_rows(bill_data, store_info))
+            writer.writerow([])
+            writer.writerow(["Overview"])
+            writer.writerows(overview_rows(bill_data))
+            charges = additional_charge_rows(bill_data)
+            if charges:
+                writer.writerow([])
+                writer.writerow(["Additional Charge"])
+                writer.writerow(ADDITIONAL_HEADERS)
+                writer.writerows(charges)
+            writer.writerow([])
+            writer.writerow(["Order Summary"])
+            writer.writerow(ORDER_HEADERS)
+            for order in orders:
+                writer.writerow(order_row(order))
+                count += 1
+        return count
+
+    def _write_json(self, path, bill_data, store_info, orders):
+        # 金额以字符串输出，保留 Decimal 精度
+        head = {
+            "store": {"id": store_info["id"], "name": store_info["name"], "address": store_info.get("address", "")},
+            "period": {
+                "start_date": bill_data["start_date"].strftime("%Y-%m-%d"),
+                "end_date": bill_data["end_date"].strftime("%Y-%m-%d"),
+            },
+            "overview": {label: value for label, value in overview_rows(bill_data)},
+            "additional_charges": [
+                dict(zip(ADDITIONAL_HEADERS, row)) for row in additional_charge_rows(bill_data)
+            ],
+        }
+        count = 0
+        with open(path, "w", encoding="utf-8") as f:
+            # 订单逐条写出，不在内存中构建完整列表：去掉 head 结尾的 "}" 后接着写 orders 数组
+            f.write(json.dumps(head, default=str, ensure_ascii=False)[:-1])
+            f.write(', "orders": [')
+            for order in orders:
+                if count:
+                    f.write(", ")
+                f.write(json.dumps(dict(zip(ORDER_HEADERS, order_row(order))), default=str, ensure_ascii=False))
+                count += 1
+            f.write("]}\n")
+        return count
+
+    def _write_xlsx(self, path, bill_data, store_info, orders):
+        openpyxl = _load_openpyxl()
+        workbook = openpyxl.Workbook(write_only=True)
+
+        summary = workbook.create_sheet("Overview")
+        for row in self._header_rows(bill_data, store_info):
+            summary.append(row)
+        summary.append([])
+        for row in overview_rows(bill_data):
+            summary.append(row)
+        charges = additional_charge_rows(bill_data)
+        if charges:
+            summary.append([])
+            summary.append(ADDITIONAL_HEADERS)
+            for row in charges:
+                summary.append(row)
+
+        sheet = workbook.create_sheet("Orders")
+        sheet.append(ORDER_HEADERS)
+        count = 0
+        for order in orders:
+            sheet.append(order_row(order))
+            count += 1
+        workbook.save(path)
+        return count
+
+
+def _load_openpyxl():
+    # openpyxl 只在导出 XLSX 时需要
+    try:
+        import openpyxl
+    except ImportError as e:
+        raise ImportError(
+            "XLSX export requires openpyxl, install it with `pip install openpyxl`"
+        ) from e
+    return openpyxl
@@ -1,17 +1,19 @@
-import mysql.connector
-import os
-from dotenv import load_dotenv
 from decimal import Decimal
+from db_pool import get_pool
+from order_record import OrderRecord, iter_order_records
 
 class DatabaseConnector:
+    # 每条 IN (...) 语句最多包含的 id 数
+    IN_CHUNK_SIZE = 500
+    # 报表渲染实际读取的订单字段
+    ORDER_COLUMNS = OrderRecord.COLUMNS
+    # 流式读取订单时每次 fetchmany 的行数
+    ORDER_FETCH_SIZE = 500
+
     def __init__(self):
-        load_dotenv()
-        self.connection = mysql.connector.connect(
-            host=os.getenv('MYSQL_HOST'),
-            user=os.getenv('MYSQL_USER'),
-            password=os.getenv('MYSQL_PASS'),
-            database=os.getenv('MYSQL_DB')
-        )
+        # 从进程级连接池借用连接，close() 时归还
+        self.pool = get_pool()
+        self.connection = self.pool.acquire()
         self.cursor = self.connection.cursor(dictionary=True)
     
     def get_pending_bills(self):
@@ -33,30 +35,187 @@ class DatabaseConnector:
         self.cursor.execute(query, (store_id,))
         return self.cursor.fetchone()
     
-    def get_user_profile(self, user_id):
-        """Get user profile information by user_id"""
+    def get_stores_info(self, store_ids):
+        """Get store information for many store_ids, returns {store_id: store}"""
+        stores = {}
+        for chunk in self._chunks(store_ids):
+            format_strings = ','.join(['%s'] * len(chunk))
+            query = f"""
+                SELECT * FROM store
+                WHERE id IN ({format_strings}) AND deleted_at IS NULL
+            """
+            self.cursor.execute(query, tuple(chunk))
+            for row in self.cursor.fetchall():
+                stores[row['id']] = row
+        return stores
+
+    def get_user_profiles(self, user_ids):
+        """Get user names for many user_ids at once, returns {user_id: name}"""
+        # 去重后分批查询，避免每个订单一次查询
+        unique_ids = list(dict.fromkeys(uid for uid in user_ids if uid is not None))
+        names = {}
+        for chunk in self._chunks(unique_ids):
+            format_strings = ','.join(['%s'] * len(chunk))
+            query = f"""
+                SELECT user_id, name FROM user_profile
+                WHERE user_id IN ({format_strings})
+            """
+            self.cursor.execute(query, tuple(chunk))
+            for row in self.cursor.fetchall():
+                names[row['user_id']] = row['name']
+        # 找不到时返回空字符串，与订单流中的用户名一致
+        for uid in unique_ids:
+            names.setdefault(uid, "")
+        return names
+    
+    def iter_orders_by_store_and_period(self, store_id, start_date, end_date, batch_size=None):
+        """Stream OrderRecords of a store/period with an unbuffered cursor, only ORDER_COLUMNS, user_name filled in"""
+        batch_size = batch_size or self.ORDER_FETCH_SIZE
+        columns = ", ".join(f"o.`{column}`" for column in self.ORDER_COLUMNS)
+        # 用户名在同一条语句中取出：流式读取只占用本连接，不再向连接池借第二个连接，
+        # 否则并发请求各自持有一个连接并等待第二个，连接池耗尽时全部超时
+        query = f"""
+            SELECT {columns},
+                   COALESCE((SELECT up.name FROM user_profile up
+                             WHERE up.user_id = o.user_id LIMIT 1), '') AS user_name
+            FROM `order` o
+            WHERE o.store_id = %s
+              AND o.complete_time >= %s
+              AND o.complete_time < DATE_ADD(%s, INTERVAL 1 DAY)
+              AND o.state = 5000
+              AND o.payment_method != 4
+            ORDER BY o.complete_time
+        """
+        # 元组游标，直接构建 OrderRecord 而不是每行一个 dict；读完之前本连接不能执行其他查询
+        cursor = self.connection.cursor(buffered=False)
+        try:
+            cursor.execute(query, (store_id, start_date, end_date))
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield from iter_order_records(rows)
+        finally:
+            # 提前停止迭代时丢弃未读的结果，连接才能继续用于后续查询
+            self.connection.consume_results()
+            cursor.close()
+
+    def get_order_stats_by_store_and_period(self, store_id, start_date, end_date):
+        """Count orders and distinct users of a store/period without fetching the rows"""
         query = """
-            SELECT name FROM user_profile
-            WHERE user_id = %s
+            SELECT COUNT(*) AS total_orders, COUNT(DISTINCT user_id) AS unique_users
+            FROM `order`
+            WHERE store_id = %s
+              AND complete_time >= %s
+              AND complete_time < DATE_ADD(%s, INTERVAL 1 DAY)
+              AND state = 5000
+              AND payment_method != 4
         """
-        self.cursor.execute(query, (user_id,))
+        self.cursor.execute(query, (store_id, start_date, end_date))
         result = self.cursor.fetchone()
-        return result['name'] if result else ""
-    
-    def get_orders_by_store_and_period(self, store_id, start_date, end_date):
-        """Get orders for a specific store within a time period (inclusive of end_date)"""
+        return {"total_orders": result["total_orders"], "unique_users": result["unique_users"]}
+
+    def get_order_digest_by_store_and_period(self, store_id, start_date, end_date):
+        """Aggregate digest of everything a store/period report prints from `order` and order_dish/order_dish_tax
+
+        订单行按 ORDER_COLUMNS 与用户名取 MD5 的前 60 位在数据库中求和，税额部分按 system_tax_id
+        汇总行数与金额；只返回几行结果，用于报告缓存的指纹，不读取订单明细
+        """
+        fields = ", ".join(f"IFNULL(o.`{column}`, '')" for column in self.ORDER_COLUMNS)
+        query = f"""
+            SELECT COUNT(*) AS total_orders,
+                   COALESCE(SUM(CAST(CONV(SUBSTRING(MD5(CONCAT_WS('|', {fields},
+                       IFNULL((SELECT up.name FROM user_profile up
+                               WHERE up.user_id = o.user_id LIMIT 1), '')
+                   )), 1, 15), 16, 10) AS UNSIGNED)), 0) AS order_digest
+            FROM `order` o
+            WHERE o.store_id = %s
+              AND o.complete_time >= %s
+              AND o.complete_time < DATE_ADD(%s, INTERVAL 1 DAY)
+              AND o.state = 5000
+              AND o.payment_method != 4
+        """
+        self.cursor.execute(query, (store_id, start_date, end_date))
+        digest = self.cursor.fetchone()
+        # GST/PST 由这些金额决定，菜品或税目更正后指纹随之变化
         query = """
-            SELECT * FROM `order`
-            WHERE store_id = %s 
-              AND complete_time >= %s 
+            SELECT odt.system_tax_id, COUNT(*) AS line_count, SUM(od.amount) AS amount
+            FROM `order` o
+            JOIN order_dish_tax odt ON odt.order_id = o.id
+            JOIN order_dish od ON odt.order_id = od.order_id AND odt.dish_id = od.dish_id
+            WHERE o.store_id = %s
+              AND o.complete_time >= %s
+              AND o.complete_time < DATE_ADD(%s, INTERVAL 1 DAY)
+              AND o.state = 5000
+              AND o.payment_method != 4
+            GROUP BY odt.system_tax_id
+            ORDER BY odt.system_tax_id
+        """
+        self.cursor.execute(query, (store_id, start_date, end_date))
+        return {
+            "total_orders": digest["total_orders"],
+            "order_digest": digest["order_digest"],
+            "tax_lines": [
+                [row["system_tax_id"], row["line_count"], row["amount"]] for row in self.cursor.fetchall()
+            ],
+        }
+
+    def get_order_ids_by_store_and_period(self, store_id, start_date, end_date):
+        """Get only the order ids of a store/period, used for tax calculation"""
+        query = """
+            SELECT id FROM `order`
+            WHERE store_id = %s
+              AND complete_time >= %s
               AND complete_time < DATE_ADD(%s, INTERVAL 1 DAY)
               AND state = 5000
               AND payment_method != 4
-            ORDER BY complete_time
         """
         self.cursor.execute(query, (store_id, start_date, end_date))
-        return self.cursor.fetchall()
-    
+        return [row["id"] for row in self.cursor.fetchall()]
+
+    def get_orders_by_stores_and_period(self, store_ids, start_date, end_date):
+        """Get OrderRecords for many stores sharing the same period, returns {store_id: [records]}"""
+        orders_by_store = {store_id: [] for store_id in store_ids}
+        columns = ", ".join(f"`{column}`" for column in self.ORDER_COLUMNS)
+        cursor = self.connection.cursor()
+        try:
+            for chunk in self._chunks(store_ids):
+                format_strings = ','.join(['%s'] * len(chunk))
+                query = f"""
+                    SELECT store_id, {columns} FROM `order`
+                    WHERE store_id IN ({format_strings})
+                      AND complete_time >= %s
+                      AND complete_time < DATE_ADD(%s, INTERVAL 1 DAY)
+                      AND state = 5000
+                      AND payment_method != 4
+                    ORDER BY store_id, complete_time
+                """
+                cursor.execute(query, (*chunk, start_date, end_date))
+                for row in cursor.fetchall():
+                    orders_by_store[row[0]].extend(iter_order_records((row[1:],)))
+        finally:
+            cursor.close()
+        return orders_by_store
+
+    def get_order_counts_by_stores_and_period(self, store_ids, start_date, end_date):
+        """Count orders of many stores sharing the same period without fetching the rows, returns {store_id: count}"""
+        counts = {store_id: 0 for store_id in store_ids}
+        for chunk in self._chunks(store_ids):
+            format_strings = ','.join(['%s'] * len(chunk))
+            query = f"""
+                SELECT store_id, COUNT(*) AS total_orders FROM `order`
+                WHERE store_id IN ({format_strings})
+                  AND complete_time >= %s
+                  AND complete_time < DATE_ADD(%s, INTERVAL 1 DAY)
+                  AND state = 5000
+                  AND payment_method != 4
+                GROUP BY store_id
+            """
+            self.cursor.execute(query, (*chunk, start_date, end_date))
+            for row in self.cursor.fetchall():
+                counts[row['store_id']] = row['total_orders']
+        return counts
+
     def get_week_bill_by_date(self, store_id, date):
         """根据日期找到包含该日期的周账单，并转换金额为Decimal"""
         query = """
@@ -89,8 +248,33 @@ class DatabaseConnector:
         self.cursor.execute(query, (store_id,))
         result = self.cursor.fetchone()
         return result['contact_email'] if result else None
+
+    def get_store_contact_emails(self, store_ids):
+        """批量获取商店联系人邮箱，返回 {store_id: contact_email}"""
+        emails = {}
+        for chunk in self._chunks(store_ids):
+            format_strings = ','.join(['%s'] * len(chunk))
+            query = f"""
+                SELECT store_id, contact_email FROM store_contact
+                WHERE deleted_at IS NULL AND store_id IN ({format_strings})
+            """
+            self.cursor.execute(query, tuple(chunk))
+            for row in self.cursor.fetchall():
+                # 与 get_store_contact_email 一致，每个商店取第一条
+                emails.setdefault(row['store_id'], row['contact_email'])
+        return emails
+
+    def _chunks(self, ids):
+        ids = list(dict.fromkeys(ids))
+        for i in range(0, len(ids), self.IN_CHUNK_SIZE):
+            yield ids[i:i + self.IN_CHUNK_SIZE]
         
     def close(self):
-        """Close database connection"""
-        self.cursor.close()
-        self.connection.close()
\ No newline at end of file
+        """Return the connection to the pool"""
+        if self.connection is None:
+            return
+        try:
+            self.cursor.close()
+        finally:
+            self.pool.release(self.connection)
+            self.connection = None
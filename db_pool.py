@@ -0,0 +1,215 @@
+import os
+import time
+import logging
+import threading
+from contextlib import contextmanager
+
+import mysql.connector
+from dotenv import load_dotenv
+
+logger = logging.getLogger(__name__)
+
+
+class PoolTimeoutError(Exception):
+    """Raised when no connection could be checked out within the pool timeout"""
+
+
+class ConnectionPool:
+    """Process-wide MySQL connection pool shared by DatabaseConnector and TaxCalculator"""
+
+    def __init__(self, size=5, timeout=30.0, recycle=3600, pre_ping=True, **connect_kwargs):
+        self.size = size
+        self.timeout = timeout
+        self.recycle = recycle
+        self.pre_ping = pre_ping
+        self._connect_kwargs = connect_kwargs
+
+        self._cond = threading.Condition()
+        self._idle = []  # [(connection, created_at)]
+        self._created_at = {}  # id(connection) -> created_at
+        self._in_use = 0
+        self._waiters = 0
+
+        # 统计信息，用于按 worker 调整连接池大小
+        self._checkouts = 0
+        self._waits = 0
+        self._total_wait_time = 0.0
+        self._max_wait_time = 0.0
+        self._timeouts = 0
+        self._connects = 0
+        self._recycled = 0
+        self._discarded = 0
+
+    def _connect(self):
+        connection = mysql.connector.connect(**self._connect_kwargs)
+        with self._cond:
+            self._connects += 1
+            self._created_at[id(connection)] = time.monotonic()
+        return connection
+
+    def _close_quietly(self, connection):
+        with self._cond:
+            self._created_at.pop(id(connection), None)
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    def _is_usable(self, connection, created_at):
+        """Health check on borrow: recycle old connections and ping the rest"""
+        if self.recycle and time.monotonic() - created_at > self.recycle:
+            with self._cond:
+                self._recycled += 1
+            return False
+        if not self.pre_ping:
+            return True
+        try:
+            connection.ping(reconnect=False)
+            return True
+        except Exception as e:
+            logger.warning(f"Discarding broken pooled connection: {e}")
+            with self._cond:
+                self._discarded += 1
+            return False
+
+    def acquire(self, block=True):
+        """Check out a connection, waiting up to `timeout` seconds when the pool is exhausted
+
+        block=False 时不等待：没有空闲名额直接返回 None，用于可选的并发连接
+        """
+        start = time.monotonic()
+        deadline = start + self.timeout
+        waited = False
+        connection, created_at = None, None
+
+        with self._cond:
+            while True:
+                if self._idle:
+                    connection, created_at = self._idle.pop()
+                    break
+                if self._in_use < self.size:
+                    # 预留一个名额，在锁外建立新连接
+                    break
+                if not block:
+                    return None
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._timeouts += 1
+                    raise PoolTimeoutError(
+                        f"Timed out after {self.timeout}s waiting for a MySQL connection "
+                        f"(pool size {self.size})"
+                    )
+                waited = True
+                self._waiters += 1
+                try:
+                    self._cond.wait(remaining)
+                finally:
+                    self._waiters -= 1
+
+            self._in_use += 1
+            self._checkouts += 1
+            if waited:
+                wait_time = time.monotonic() - start
+                self._waits += 1
+                self._total_wait_time += wait_time
+                self._max_wait_time = max(self._max_wait_time, wait_time)
+
+        try:
+            if connection is not None and not self._is_usable(connection, created_at):
+                self._close_quietly(connection)
+                connection = None
+            if connection is None:
+                connection = self._connect()
+        except Exception:
+            with self._cond:
+                self._in_use -= 1
+                self._cond.notify()
+            raise
+        return connection
+
+    def release(self, connection, discard=False):
+        """Return a connection to the pool, closing it if it is broken or has unread results"""
+        try:
+            if not discard and (connection.unread_result or not connection.is_connected()):
+                discard = True
+        except Exception:
+            discard = True
+
+        if discard:
+            self._close_quietly(connection)
+            with self._cond:
+                self._discarded += 1
+
+        with self._cond:
+            self._in_use -= 1
+            if not discard:
+                created_at = self._created_at.get(id(connection), time.monotonic())
+                self._idle.append((connection, created_at))
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self):
+        """with pool.connection() as conn: ..."""
+        connection = self.acquire()
+        try:
+            yield connection
+        finally:
+            self.release(connection)
+
+    def stats(self):
+        """Snapshot of pool usage"""
+        with self._cond:
+            return {
+                "size": self.size,
+                "open": self._in_use + len(self._idle),
+                "in_use": self._in_use,
+                "idle": len(self._idle),
+                "waiters": self._waiters,
+                "checkouts": self._checkouts,
+                "waits": self._waits,
+                "total_wait_time": round(self._total_wait_time, 6),
+                "avg_wait_time": round(self._total_wait_time / self._waits, 6) if self._waits else 0.0,
+                "max_wait_time": round(self._max_wait_time, 6),
+                "timeouts": self._timeouts,
+                "connects": self._connects,
+                "recycled": self._recycled,
+                "discarded": self._discarded,
+            }
+
+    def close(self):
+        """Close all idle connections"""
+        with self._cond:
+            idle, self._idle = self._idle, []
+        for connection, _ in idle:
+            self._close_quietly(connection)
+
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """Return the process-wide pool, creating it on first use (and again after fork)"""
+    global _pool, _pool_pid
+    pid = os.getpid()
+    if _pool is not None and _pool_pid == pid:
+        return _pool
+    with _pool_lock:
+        if _pool is None or _pool_pid != pid:
+            # fork 之后不能复用父进程的 socket，直接丢弃引用而不关闭
+            load_dotenv()
+            _pool = ConnectionPool(
+                size=int(os.getenv("MYSQL_POOL_SIZE", "5")),
+                timeout=float(os.getenv("MYSQL_POOL_TIMEOUT", "30")),
+                recycle=int(os.getenv("MYSQL_POOL_RECYCLE", "3600")),
+                pre_ping=os.getenv("MYSQL_POOL_PRE_PING", "1") not in ("0", "false", "False"),
+                host=os.getenv("MYSQL_HOST"),
+                user=os.getenv("MYSQL_USER"),
+                password=os.getenv("MYSQL_PASS"),
+                database=os.getenv("MYSQL_DB"),
+                # 连接会被多次复用，自动提交避免长事务读到旧快照
+                autocommit=True,
+            )
+            _pool_pid = pid
+    return _pool
@@ -1,11 +1,25 @@
 import os
-import sys
+import time
+import argparse
 from db_connector import DatabaseConnector
-from report_generator import ReportGenerator
 from tax_cal import TaxCalculator  # 导入税额计算器
+from bill_builder import build_bill_data
+from batch_pipeline import PREFETCH_CONNECTIONS, BatchPipeline, report_writer, write_summary
+from db_pool import get_pool
+from run_manifest import RunManifest, bill_key
+from batch_plan import dispatch_order, format_plan, plan_bills
+from sharding import (
+    filter_store_range,
+    manifest_name,
+    merge_manifests,
+    parse_shard,
+    parse_store_range,
+    select_shard,
+    write_summary_json,
+)
+from data_exporter import EXPORT_FORMATS
 import logging
 import datetime
-from decimal import Decimal
 
 # Configure logging
 logging.basicConfig(
@@ -16,14 +30,238 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
-def main():
-    # 如果传入两个参数，则单报告模式：store_id 和日期（格式：YYYY-MM-DD）
-    if len(sys.argv) == 3:
+def _cli_type(parse):
+    # 解析错误交给 argparse 输出原始提示
+    def convert(value):
+        try:
+            return parse(value)
+        except ValueError as e:
+            raise argparse.ArgumentTypeError(str(e))
+    return convert
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Generate weekly store reports")
+    parser.add_argument("store_id", nargs="?", type=int, help="单报告模式：商户 ID")
+    parser.add_argument("date", nargs="?", help="单报告模式：账单周内任一日期 YYYY-MM-DD")
+    parser.add_argument(
+        "--format",
+        choices=("pdf",) + EXPORT_FORMATS,
+        default="pdf",
+        help="pdf 渲染报告；csv / json / xlsx 只导出数据，不渲染页面",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=int(os.getenv("REPORT_BATCH_WORKERS", 1)),
+        help="批量模式的渲染进程数，每个进程持有预加载的 ReportGenerator",
+    )
+    parser.add_argument(
+        "--prefetch-workers",
+        type=int,
+        default=int(os.getenv("REPORT_PREFETCH_WORKERS", 1)),
+        help="批量模式的数据库预取线程数，每个线程持有独立的数据库连接",
+    )
+    parser.add_argument(
+        "--output-workers",
+        type=int,
+        default=int(os.getenv("REPORT_OUTPUT_WORKERS", 2)),
+        help="批量模式的输出/上传线程数",
+    )
+    parser.add_argument("--upload", action="store_true", help="批量模式下把生成的文件上传到 S3")
+    parser.add_argument(
+        "--resume",
+        metavar="BATCH_DIR",
+        help="继续之前中断的批量任务：跳过已完成的账单，只重新处理失败或未完成的账单",
+    )
+    parser.add_argument(
+        "--shard",
+        type=_cli_type(parse_shard),
+        metavar="i/N",
+        help="多节点批量：只处理 N 个分片中的第 i 个（0 <= i < N），各节点使用相同的 N",
+    )
+    parser.add_argument(
+        "--shard-balance",
+        choices=("hash", "pages"),
+        default="hash",
+        help=(
+            "hash（默认）按账单哈希取模，各节点的划分互不依赖；pages 按预计页数均衡，"
+            "但要求所有节点读到完全相同的账单与订单数，否则会漏掉或重复账单"
+        ),
+    )
+    parser.add_argument(
+        "--store-range",
+        type=_cli_type(parse_store_range),
+        metavar="A-B",
+        help="只处理 store_id 在 A 到 B 之间（含两端）的账单，可与 --shard 同时使用",
+    )
+    parser.add_argument(
+        "--batch-dir",
+        help="批量输出目录，默认 generated_reports/report_batch_<时间戳>；多个节点可共用同一目录",
+    )
+    parser.add_argument(
+        "--plan",
+        action="store_true",
+        help="只做规划：按 COUNT(*) 预估每个账单的页数并输出调度计划，不生成报告",
+    )
+    parser.add_argument(
+        "--merge",
+        nargs="+",
+        metavar="BATCH_DIR",
+        help=(
+            "合并各分片的 manifest，在第一个目录写出 summary.txt 与 summary.json；"
+            "并与 get_pending_bills()（及 --store-range）核对，报告未被任何分片处理的账单"
+        ),
+    )
+    args = parser.parse_args(argv)
+    if args.store_id is not None and args.date is None:
+        parser.error("date is required when store_id is given")
+    for name in ("workers", "prefetch_workers", "output_workers"):
+        if getattr(args, name) < 1:
+            parser.error(f"--{name.replace('_', '-')} must be at least 1")
+    # 连接池不够时预取线程会在借连接时超时，启动前就报错
+    pool_size = get_pool().size
+    if args.prefetch_workers * PREFETCH_CONNECTIONS > pool_size:
+        parser.error(
+            f"--prefetch-workers {args.prefetch_workers} needs "
+            f"{args.prefetch_workers * PREFETCH_CONNECTIONS} pooled connections, "
+            f"but MYSQL_POOL_SIZE is {pool_size}"
+        )
+    return args
+
+
+def run_batch(args):
+    logger.info("Starting batch report generation process")
+    started = time.perf_counter()
+
+    try:
+        batch_timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+        shard_index, shard_count = args.shard or (None, None)
+        manifest_file = manifest_name(shard_index, shard_count)
+        if args.resume:
+            batch_dir = os.path.abspath(args.resume)
+            if not os.path.exists(os.path.join(batch_dir, manifest_file)):
+                logger.error(f"No {manifest_file} found in {batch_dir}, cannot resume")
+                return
+            logger.info(f"Resuming batch in {batch_dir}")
+        elif args.batch_dir:
+            batch_dir = os.path.abspath(args.batch_dir)
+        else:
+            # Create timestamped batch folder for this run
+            # Use a better way to get the base directory
+            base_dir = os.path.join(
+                os.path.dirname(os.path.abspath(__file__)), "generated_reports"
+            )
+
+            if not os.path.exists(base_dir):
+                os.makedirs(base_dir)
+
+            batch_dir = os.path.join(base_dir, f"report_batch_{batch_timestamp}")
+            if args.shard:
+                batch_dir += f"_shard{shard_index}of{shard_count}"
+        manifest = RunManifest(batch_dir, output_format=args.format, name=manifest_file)
+
+        # Get all pending bills
+        db = DatabaseConnector()
+        try:
+            bills = db.get_pending_bills()
+            logger.info(f"Found {len(bills)} pending bills")
+            if args.store_range:
+                bills = filter_store_range(bills, args.store_range)
+            if args.shard and args.shard_balance == "hash":
+                # 按键哈希分片不需要页数，先选出本分片再只为这些账单做规划
+                bills = select_shard(bills, shard_index, shard_count)
+            # 规划：COUNT(*) 预估每个账单的页数，用于分片均衡与大账单优先调度
+            plans = plan_bills(db, bills)
+            if args.shard and args.shard_balance == "pages":
+                # 按页数均衡需要整批账单的页数；每个节点看到同样的账单列表并得到同样的划分
+                weights = [plan.pages for plan in plans]
+                selected = {
+                    bill_key(bill) for bill in select_shard(bills, shard_index, shard_count, weights)
+                }
+                plans = [plan for plan in plans if bill_key(plan.bill) in selected]
+                bills = [plan.bill for plan in plans]
+        finally:
+            db.close()
+        logger.info(f"Found {len(bills)} bills to process")
+
+        # 续跑时已完成且账单行未变化的账单直接沿用之前的结果
+        completed = {idx for idx, bill in enumerate(bills) if manifest.is_done(bill)}
+        if completed:
+            logger.info(f"Skipping {len(completed)} bills completed in an earlier run")
+        todo = [plan for idx, plan in enumerate(plans) if idx not in completed]
+
+        if args.plan:
+            print(format_plan(todo, args.workers, skipped=len(completed)))
+            return
+
+        # 预取、渲染、输出三个阶段重叠执行，见 BatchPipeline
+        pipeline = BatchPipeline(
+            batch_dir,
+            output_format=args.format,
+            prefetch_workers=args.prefetch_workers,
+            render_workers=args.workers,
+            output_workers=args.output_workers,
+            upload=args.upload,
+            manifest=manifest,
+        )
+        # 页数最多的账单先进入流水线，空闲的渲染进程总是领取剩余中最大的账单
+        order = dispatch_order(todo)
+        rendered = [None] * len(todo)
+        for idx, result in zip(order, pipeline.run([todo[idx].bill for idx in order])):
+            rendered[idx] = result
+        rendered = iter(rendered)
+        results = [
+            manifest.result(bill) if idx in completed else next(rendered)
+            for idx, bill in enumerate(bills)
+        ]
+
+        elapsed = time.perf_counter() - started
+        summary_file = "summary.txt"
+        if args.shard:
+            # 共用目录时各分片的 summary 互不覆盖，合并后由 --merge 写出 summary.txt
+            summary_file = f"summary.shard-{shard_index}-of-{shard_count}.txt"
+        summary_path = write_summary(batch_dir, batch_timestamp, results, elapsed, summary_file)
+        logger.info(
+            f"Report generation completed in {elapsed:.1f}s with {args.workers} render worker(s). "
+            f"Summary saved to: {summary_path}"
+        )
+        logger.info(f"All reports saved in: {batch_dir}")
+
+    except Exception as e:
+        logger.error(f"Error generating reports: {e}", exc_info=True)
+
+
+def run_merge(batch_dirs, store_range=None):
+    """Combine shard manifests into summary.txt / summary.json in the first batch directory"""
+    # 与分片运行时相同的账单集合，用于检查是否有账单没有被任何分片处理
+    db = DatabaseConnector()
+    try:
+        bills = db.get_pending_bills()
+    finally:
+        db.close()
+    if store_range:
+        bills = filter_store_range(bills, store_range)
+    results, elapsed = merge_manifests(batch_dirs, expected_bills=bills)
+    output_dir = batch_dirs[0]
+    batch_timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+    summary_path = write_summary(output_dir, batch_timestamp, results, elapsed)
+    json_path = write_summary_json(os.path.join(output_dir, "summary.json"), results, elapsed)
+    logger.info(f"Merged {len(results)} bills from {len(batch_dirs)} batch dir(s): {summary_path}, {json_path}")
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.merge:
+        run_merge(args.merge, args.store_range)
+        return
+    # 传入 store_id 和日期（格式：YYYY-MM-DD）时为单报告模式
+    if args.store_id is not None:
+        store_id = args.store_id
         try:
-            store_id = int(sys.argv[1])
-            input_date = datetime.datetime.strptime(sys.argv[2], "%Y-%m-%d")
-        except Exception as e:
-            logger.error("Invalid arguments. Usage: python main.py <store_id> <YYYY-MM-DD>")
+            input_date = datetime.datetime.strptime(args.date, "%Y-%m-%d")
+        except ValueError:
+            logger.error("Invalid arguments. Usage: python main.py <store_id> <YYYY-MM-DD> [--format FORMAT]")
             return
 
         db = DatabaseConnector()
@@ -45,195 +283,30 @@ def main():
         end_date = week_bill["end_date"]
         logger.info(f"Found weekly bill from {start_date.strftime('%Y-%m-%d')} to {end_date.strftime('%Y-%m-%d')} for store_id {store_id}")
         
-        # 查询该周期内的所有订单
-        orders = db.get_orders_by_store_and_period(store_id, start_date, end_date)
-        logger.info(f"Found {len(orders)} orders for store_id {store_id} in period {start_date.strftime('%Y-%m-%d')} to {end_date.strftime('%Y-%m-%d')}")
+        # 订单统计由数据库聚合，明细在生成报告时流式读取
+        order_stats = db.get_order_stats_by_store_and_period(store_id, start_date, end_date)
+        logger.info(f"Found {order_stats['total_orders']} orders for store_id {store_id} in period {start_date.strftime('%Y-%m-%d')} to {end_date.strftime('%Y-%m-%d')}")
 
-        # 填充每个订单的 user_name
-        for order in orders:
-            order["user_name"] = db.get_user_profile(order["user_id"])
-        
         # 计算所有订单的PST总额
-        order_ids = [order.get("id") for order in orders if order.get("id")]
+        order_ids = db.get_order_ids_by_store_and_period(store_id, start_date, end_date)
         tax_calculator = TaxCalculator()
-        tax_totals = tax_calculator.calculate_taxes(order_ids)
+        tax_totals = tax_calculator.calculate_taxes(order_ids, as_of=start_date)
         tax_calculator.close()
-        
-        # 从周账单中获取数据，使用Decimal确保精度
-        total_orders = len(orders)
-        
-        # 确保所有金额使用Decimal
-        original_price = Decimal(str(week_bill.get("original_price", 0)))
-        GST = Decimal(str(week_bill.get("product_tax_fee", 0)))
-        PST_total = Decimal(str(tax_totals["PST_total"]))
-        GST_total = GST - PST_total  # 使用Decimal计算
-        
-        # 计算Additional_charge，使用与批量报告相同的公式
-        commission_fee = Decimal(str(week_bill.get("commission_fee", 0)))
-        refund_commission_fee = Decimal(str(week_bill.get("refund_commission_fee", 0)))
-        asset_balance_repayment = Decimal(str(week_bill.get("asset_balance_repayment", 0)))
-        extra_fee = Decimal(str(week_bill.get("extra_fee", 0)))
-        
-        additional_charge = -(
-            commission_fee
-            - refund_commission_fee
-            + asset_balance_repayment
-            - extra_fee
+
+        bill_data = build_bill_data(
+            week_bill, tax_totals, order_stats["total_orders"], order_stats["unique_users"]
         )
-        
-        # 构建bill_data时确保所有金额值都是Decimal
-        bill_data = {
-            "start_date": start_date,
-            "end_date": end_date,
-            "store_amount": Decimal(str(week_bill.get("store_amount", 0))),
-            "original_price": original_price,
-            "discount_fee": Decimal(str(week_bill.get("discount_fee", 0))),
-            "refund_amount": Decimal(str(week_bill.get("refund_amount", 0))),
-            "pickup_tip_fee": Decimal(str(week_bill.get("pickup_tip_fee", 0))),
-            "product_tax_fee": GST,  # 这是原始 GST
-            "commission_fee": commission_fee,
-            "refund_commission_fee": refund_commission_fee,
-            "asset_balance_repayment": asset_balance_repayment, # 这是原始服务包费用，避免转账和报表发生的服务费不一致
-            "extra_fee": extra_fee,
-            "total_orders": total_orders,
-            "total_revenue": original_price - Decimal(str(week_bill.get("discount_fee", 0))) - Decimal(str(week_bill.get("refund_amount", 0))),
-            "unique_users": len(set(order["user_id"] for order in orders)),
-            "GST": GST,  # 设置从周账单中获取的 GST
-            "GST_total": GST_total,  # 设置为 GST - PST_total
-            "PST_total": PST_total,    # 从订单计算的 PST_total
-            "Additional_charge": additional_charge  # 添加 Additional_charge
-        }
-
-        # 其他周账单数据，使用Decimal转换数值
-        for key in ["stripe_fee", "remark"]:
-            if key in week_bill:
-                if isinstance(week_bill[key], (int, float)):
-                    bill_data[key] = Decimal(str(week_bill[key]))
-                else:
-                    bill_data[key] = week_bill[key]
 
         output_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)),
                                   "generated_reports",
                                   f"report_single_{store_id}_{input_date.strftime('%Y%m%d')}")
-        report_gen = ReportGenerator(output_dir=output_dir)
-        pdf_path = report_gen.generate_report(bill_data, store_info, orders)
+        orders = db.iter_orders_by_store_and_period(store_id, start_date, end_date)
+        write = report_writer(output_dir, args.format)
+        pdf_path = write(bill_data, store_info, orders, order_count=order_stats["total_orders"])
         logger.info(f"Report for store {store_id} on {input_date.strftime('%Y-%m-%d')} generated: {pdf_path}")
         db.close()
     else:
-        # 批量处理逻辑（原有代码）...
-        logger.info("Starting batch report generation process")
-
-        try:
-            # Create timestamped batch folder for this run
-            batch_timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-            # Use a better way to get the base directory
-            base_dir = os.path.join(
-                os.path.dirname(os.path.abspath(__file__)), "generated_reports"
-            )
-
-            if not os.path.exists(base_dir):
-                os.makedirs(base_dir)
-
-            batch_dir = os.path.join(base_dir, f"report_batch_{batch_timestamp}")
-
-            # Connect to database
-            db = DatabaseConnector()
-            report_gen = ReportGenerator(output_dir=batch_dir)
-            tax_calculator = TaxCalculator() # 实例化税额计算器
-
-            # Get all pending bills
-            bills = db.get_pending_bills()
-            logger.info(f"Found {len(bills)} bills to process")
-
-            successful_reports = []
-
-            for bill in bills:
-                logger.info(f"Processing bill for store_id: {bill['store_id']}")
-
-                # Get store information
-                store_info = db.get_store_info(bill["store_id"])
-                if not store_info:
-                    logger.warning(f"Store info not found for store_id: {bill['store_id']}")
-                    continue
-
-                # Get orders for this store within the specified period
-                orders = db.get_orders_by_store_and_period(
-                    bill["store_id"], bill["start_date"], bill["end_date"]
-                )
-                logger.info(f"Found {len(orders)} orders for {store_info['name']}")
-
-                # 填充每个订单的 user_name，从 user_profile 表获取
-                for order in orders:
-                    order["user_name"] = db.get_user_profile(order["user_id"])
-
-                # 计算所有订单的PST总额，确保使用Decimal
-                order_ids = [order.get("id") for order in orders if order.get("id")]
-                tax_totals = tax_calculator.calculate_taxes(order_ids)
-                
-                # 设置 GST 和计算 GST_total，确保使用Decimal
-                GST = Decimal(str(bill.get("product_tax_fee", 0)))
-                PST_total = Decimal(str(tax_totals["PST_total"]))
-                bill["GST"] = GST
-                bill["GST_total"] = GST - PST_total  # 使用Decimal计算
-                bill["PST_total"] = PST_total
-
-                # Add total_orders based on orders count
-                bill["total_orders"] = len(orders)
-                # Calculate total_revenue = original_price - refund_amount
-                bill["total_revenue"] = (
-                    Decimal(str(bill.get("original_price", 0)))
-                    - Decimal(str(bill.get("discount_fee", 0)))
-                    - Decimal(str(bill.get("refund_amount", 0)))
-                )
-                # 计算unique_users
-                bill["unique_users"] = len(set(order["user_id"] for order in orders))
-
-                # 新增 GST from product_tax_fee
-                bill["GST"] = bill.get("product_tax_fee", 0)
-
-                # 确保Additional_charge计算使用Decimal
-                bill["Additional_charge"] = -(
-                    Decimal(str(bill.get("commission_fee", 0)))
-                    - Decimal(str(bill.get("refund_commission_fee", 0)))
-                    + Decimal(str(bill.get("asset_balance_repayment", 0)))
-                    - Decimal(str(bill.get("extra_fee", 0)))
-                )
-
-                # Generate report
-                report_path = report_gen.generate_report(bill, store_info, orders)
-                successful_reports.append(
-                    {
-                        "store_name": store_info["name"],
-                        "store_id": bill["store_id"],
-                        "report_path": report_path,
-                    }
-                )
-                logger.info(f"Generated report: {report_path}")
-
-            # Create a summary file with links to all generated reports
-            summary_path = os.path.join(batch_dir, "summary.txt")
-            with open(summary_path, "w") as f:
-                f.write(f"Report Generation Summary - {batch_timestamp}\n")
-                f.write(f"Total reports generated: {len(successful_reports)}\n\n")
-
-                for idx, report in enumerate(successful_reports, 1):
-                    f.write(f"{idx}. {report['store_name']} (ID: {report['store_id']})\n")
-                    f.write(f"   Path: {report['report_path']}\n\n")
-
-            logger.info(
-                f"Report generation completed successfully. Summary saved to: {summary_path}"
-            )
-            logger.info(f"All reports saved in: {batch_dir}")
-
-            tax_calculator.close() # 关闭税额计算器连接
-
-        except Exception as e:
-            logger.error(f"Error generating reports: {e}", exc_info=True)
-
-        finally:
-            # Close database connection
-            if "db" in locals():
-                db.close()
+        run_batch(args)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,74 @@
+class OrderRecord:
+    """Compact order row shared by every stage, from the cursor to the renderer
+
+    只保存报表需要的字段，使用 __slots__ 避免每个订单一个 dict。
+    通过 iter_order_records / as_order_records 构建时已完成过滤，后续阶段无需再过滤。
+    """
+
+    # 与 DatabaseConnector.ORDER_COLUMNS 的顺序一致
+    COLUMNS = (
+        "id", "user_id", "created_at", "pickup_code", "store_total_fee",
+        "refund_amount", "tip_fee", "payment_method", "state", "channel",
+    )
+    __slots__ = COLUMNS + ("user_name",)
+
+    def __init__(
+        self, id, user_id, created_at, pickup_code, store_total_fee,
+        refund_amount=0, tip_fee=0, payment_method=None, state=None, channel=1,
+        user_name="",
+    ):
+        self.id = id
+        self.user_id = user_id
+        self.created_at = created_at
+        self.pickup_code = pickup_code
+        self.store_total_fee = store_total_fee
+        self.refund_amount = refund_amount
+        self.tip_fee = tip_fee
+        self.payment_method = payment_method
+        self.state = state
+        self.channel = channel
+        self.user_name = user_name
+
+    @classmethod
+    def from_dict(cls, order):
+        """Build from a dict order (mysql dictionary cursor row or manual input)"""
+        return cls(
+            order.get("id"),
+            order.get("user_id"),
+            order.get("created_at"),
+            order.get("pickup_code"),
+            order.get("store_total_fee"),
+            order.get("refund_amount", 0),
+            order.get("tip_fee", 0),
+            order.get("payment_method"),
+            order.get("state"),
+            order.get("channel", 1),
+            order.get("user_name", ""),
+        )
+
+    def __repr__(self):
+        return f"OrderRecord(id={self.id!r}, user_id={self.user_id!r}, created_at={self.created_at!r})"
+
+
+def is_reportable(payment_method, state):
+    """过滤 payment_method == 4 的订单 (4: Cash)，并且状态为 5000 (已完成)"""
+    return payment_method != 4 and state == 5000
+
+
+def iter_order_records(rows):
+    """Build records from cursor tuples in OrderRecord.COLUMNS order, applying the report filter once"""
+    # payment_method 与 state 在元组中的位置
+    pay_idx = OrderRecord.COLUMNS.index("payment_method")
+    state_idx = OrderRecord.COLUMNS.index("state")
+    for row in rows:
+        if is_reportable(row[pay_idx], row[state_idx]):
+            yield OrderRecord(*row)
+
+
+def as_order_records(orders):
+    """Accept records or dict orders; dicts are converted and filtered, records pass through"""
+    for order in orders:
+        if isinstance(order, OrderRecord):
+            yield order
+        elif is_reportable(order.get("payment_method"), order.get("state")):
+            yield OrderRecord.from_dict(order)
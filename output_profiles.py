@@ -0,0 +1,60 @@
+from collections import namedtuple
+from PIL import Image
+
+# 输出配置：scale 为相对模板像素的缩放比例（页面尺寸不变，相当于降低 DPI），
+# mode 为页面颜色模式 RGB / L（灰度）/ P（调色板），encoding 为 jpeg 或 flate，
+# quality 为 JPEG 质量（None 表示 PIL 默认值），colors 为调色板颜色数
+OutputProfile = namedtuple(
+    "OutputProfile", ["name", "scale", "mode", "encoding", "quality", "colors"]
+)
+
+PROFILES = {
+    # 原始分辨率 RGB JPEG，与之前的输出一致
+    "archival": OutputProfile("archival", 1.0, "RGB", "jpeg", None, None),
+    # 邮件附件：半分辨率、16 色调色板、Flate 无损压缩，页面只有少量颜色，文字边缘保持清晰
+    "email": OutputProfile("email", 0.5, "P", "flate", None, 16),
+    # 预览：四分之一分辨率灰度
+    "preview": OutputProfile("preview", 0.25, "L", "flate", None, None),
+}
+DEFAULT_PROFILE = "archival"
+
+
+def get_profile(profile=None):
+    """Resolve a profile name (or OutputProfile) to an OutputProfile"""
+    if isinstance(profile, OutputProfile):
+        return profile
+    name = profile or DEFAULT_PROFILE
+    if name not in PROFILES:
+        raise ValueError(f"Unknown output profile {name!r}, expected one of {tuple(PROFILES)}")
+    return PROFILES[name]
+
+
+def _scale(img, profile):
+    if profile.scale == 1.0:
+        return img
+    size = (max(1, round(img.width * profile.scale)), max(1, round(img.height * profile.scale)))
+    # BOX 为面积平均，缩小文字页面时足够清晰且比 LANCZOS 快得多
+    return img.resize(size, Image.BOX)
+
+
+def build_palette(img, profile):
+    """Compute a reusable palette image from a representative RGB page, None unless the profile is P
+
+    同一份报告的详情页颜色相同，用底图算一次调色板后各页直接映射，避免每页重新量化
+    """
+    if profile.mode != "P":
+        return None
+    # 不抖动，纯色区域保持为单一颜色，压缩率更高
+    return _scale(img, profile).quantize(colors=profile.colors or 256, dither=Image.Dither.NONE)
+
+
+def apply_profile(img, profile, palette=None):
+    """Downscale and convert an RGB page image to the profile's pixel mode"""
+    img = _scale(img, profile)
+    if profile.mode == "P":
+        if palette is not None:
+            return img.quantize(palette=palette, dither=Image.Dither.NONE)
+        return img.quantize(colors=profile.colors or 256, dither=Image.Dither.NONE)
+    if img.mode != profile.mode:
+        return img.convert(profile.mode)
+    return img
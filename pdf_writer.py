@@ -0,0 +1,232 @@
+import io
+import os
+import zlib
+import logging
+import tempfile
+from collections import namedtuple
+from contextlib import contextmanager
+from PIL import Image
+from output_profiles import apply_profile, get_profile
+
+logger = logging.getLogger(__name__)
+
+# 已编码的页面图像：像素尺寸、PDF 颜色空间、过滤器与数据，page_width/page_height 为页面尺寸 (pt)
+EncodedPage = namedtuple(
+    "EncodedPage",
+    ["width", "height", "color_space", "bits", "filter", "data", "page_width", "page_height"],
+)
+
+
+def flatten_to_rgb(img):
+    """去掉透明通道，以白色为背景转换为RGB"""
+    if img.mode == "RGBA" or img.mode == "LA":
+        # 创建白色背景
+        bg = Image.new("RGB", img.size, (255, 255, 255))
+        # 使用alpha通道作为遮罩
+        bg.paste(img, (0, 0), img.split()[-1])
+        return bg
+    if img.mode != "RGB":
+        return img.convert("RGB")
+    return img
+
+
+def encode_page(img, page_size=None, profile=None, palette=None):
+    """Encode one PIL page as an image XObject according to an output profile
+
+    默认 archival 配置与 PIL 自带 PDF 写入器对 RGB 页面的编码一致（JPEG）。
+    页面尺寸 (pt) 始终取原始像素尺寸，缩放只降低图像分辨率；palette 见 output_profiles.build_palette。
+    """
+    profile = get_profile(profile)
+    img = flatten_to_rgb(img)
+    page_width, page_height = page_size or img.size
+    img = apply_profile(img, profile, palette)
+
+    if img.mode == "P":
+        palette = img.getpalette()[: 3 * (img.getextrema()[1] + 1)]
+        color_space = f"[/Indexed /DeviceRGB {len(palette) // 3 - 1} <{bytes(palette).hex()}>]"
+    elif img.mode == "L":
+        color_space = "/DeviceGray"
+    else:
+        color_space = "/DeviceRGB"
+
+    if profile.encoding == "jpeg":
+        if img.mode == "P":
+            raise ValueError("JPEG encoding does not support palette pages")
+        buf = io.BytesIO()
+        if profile.quality is None:
+            img.save(buf, format="JPEG")
+        else:
+            img.save(buf, format="JPEG", quality=profile.quality)
+        return EncodedPage(
+            img.width, img.height, color_space, 8, "/DCTDecode", buf.getvalue(), page_width, page_height
+        )
+
+    bits = 8
+    if img.mode == "P" and len(palette) // 3 <= 16:
+        # 16 色以内每像素 4 bit，每行按字节对齐
+        bits = 4
+        raw = img.tobytes("raw", "P;4")
+    else:
+        raw = img.tobytes()
+    return EncodedPage(
+        img.width, img.height, color_space, bits, "/FlateDecode", zlib.compress(raw, 6), page_width, page_height
+    )
+
+
+def default_file_mode():
+    # mkstemp 创建的文件权限为 0600，替换前恢复为普通 open() 的默认权限
+    umask = os.umask(0)
+    os.umask(umask)
+    return 0o666 & ~umask
+
+
+@contextmanager
+def atomic_output(output_path):
+    """Yield a temp path next to output_path; on success fsync it and rename it into place"""
+    directory = os.path.dirname(os.path.abspath(output_path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(
+        dir=directory, prefix=f".{os.path.basename(output_path)}.", suffix=".tmp"
+    )
+    os.close(fd)
+    try:
+        yield tmp_path
+        with open(tmp_path, "rb+") as f:
+            os.fsync(f.fileno())
+        os.chmod(tmp_path, default_file_mode())
+        os.replace(tmp_path, output_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+class StreamingPdfWriter:
+    """Write image pages straight into one PDF file in a single pass
+
+    每页编码后立即写入输出流，不再逐页生成临时PDF再解析；文件先写到同目录的临时文件，
+    close() 时 fsync 并原子重命名到 output_path。
+    """
+
+    CATALOG_ID = 1
+    PAGES_ID = 2
+
+    def __init__(self, output_path):
+        self.output_path = output_path
+        directory = os.path.dirname(os.path.abspath(output_path))
+        os.makedirs(directory, exist_ok=True)
+        fd, self._tmp_path = tempfile.mkstemp(
+            dir=directory, prefix=f".{os.path.basename(output_path)}.", suffix=".tmp"
+        )
+        self._file = os.fdopen(fd, "wb")
+        self._offsets = {}
+        self._next_id = self.PAGES_ID + 1
+        self._page_ids = []
+        self._closed = False
+        self._file.write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+        return False
+
+    @property
+    def page_count(self):
+        return len(self._page_ids)
+
+    def _alloc(self):
+        obj_id = self._next_id
+        self._next_id += 1
+        return obj_id
+
+    def _write_object(self, obj_id, body, stream=None):
+        self._offsets[obj_id] = self._file.tell()
+        self._file.write(f"{obj_id} 0 obj\n".encode())
+        self._file.write(body)
+        if stream is not None:
+            self._file.write(b"\nstream\n")
+            self._file.write(stream)
+            self._file.write(b"\nendstream")
+        self._file.write(b"\nendobj\n")
+
+    def add_page(self, img, page_size=None, profile=None, palette=None):
+        """Encode and append a PIL image as the next page"""
+        return self.add_encoded_page(encode_page(img, page_size, profile, palette))
+
+    def add_encoded_page(self, page):
+        """Append an already encoded page (see encode_page)"""
+        image_id, content_id, page_id = self._alloc(), self._alloc(), self._alloc()
+        self._write_object(
+            image_id,
+            (
+                f"<< /Type /XObject /Subtype /Image /Width {page.width} /Height {page.height} "
+                f"/ColorSpace {page.color_space} /BitsPerComponent {page.bits} "
+                f"/Filter {page.filter} /Length {len(page.data)} >>"
+            ).encode(),
+            page.data,
+        )
+        content = f"q {page.page_width} 0 0 {page.page_height} 0 0 cm /Im0 Do Q".encode()
+        self._write_object(content_id, f"<< /Length {len(content)} >>".encode(), content)
+        self._write_object(
+            page_id,
+            (
+                f"<< /Type /Page /Parent {self.PAGES_ID} 0 R "
+                f"/MediaBox [0 0 {page.page_width} {page.page_height}] "
+                f"/Resources << /XObject << /Im0 {image_id} 0 R >> /ProcSet [/PDF /ImageC /ImageB /ImageI] >> "
+                f"/Contents {content_id} 0 R >>"
+            ).encode(),
+        )
+        self._page_ids.append(page_id)
+        return len(self._page_ids)
+
+    def close(self):
+        """Finish the document, fsync and atomically move it to output_path"""
+        if self._closed:
+            return self.output_path
+        try:
+            self._write_object(
+                self.CATALOG_ID, f"<< /Type /Catalog /Pages {self.PAGES_ID} 0 R >>".encode()
+            )
+            kids = " ".join(f"{page_id} 0 R" for page_id in self._page_ids)
+            self._write_object(
+                self.PAGES_ID,
+                f"<< /Type /Pages /Kids [{kids}] /Count {len(self._page_ids)} >>".encode(),
+            )
+
+            xref_offset = self._file.tell()
+            size = self._next_id
+            lines = [f"xref\n0 {size}\n", "0000000000 65535 f \n"]
+            for obj_id in range(1, size):
+                lines.append(f"{self._offsets[obj_id]:010d} 00000 n \n")
+            self._file.write("".join(lines).encode())
+            self._file.write(
+                f"trailer\n<< /Size {size} /Root {self.CATALOG_ID} 0 R >>\n"
+                f"startxref\n{xref_offset}\n%%EOF\n".encode()
+            )
+            # 确保文件完全写入磁盘后再替换，取代原先的 sleep
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+            os.chmod(self._tmp_path, default_file_mode())
+            os.replace(self._tmp_path, self.output_path)
+        except BaseException:
+            self.abort()
+            raise
+        self._closed = True
+        return self.output_path
+
+    def abort(self):
+        """Discard the partial file"""
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            self._file.close()
+        finally:
+            if os.path.exists(self._tmp_path):
+                os.remove(self._tmp_path)
@@ -0,0 +1,92 @@
+import os
+import json
+import logging
+import threading
+from PIL import ImageFont
+
+from template_store import FlattenedTemplateStore
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+FONT_DIR = os.path.join(BASE_DIR, "fonts")
+TEMPLATE_DIR = os.path.join(BASE_DIR, "report_template")
+POS_CONFIG_PATH = os.path.join(BASE_DIR, "pos_config.json")
+
+# Define font styles with various sizes for different data, using DMSans for all except Roboto Mono
+# 字体大小调整，适应模板
+FONT_SPECS = {
+    "regular": {
+        "small": ("DMSans-Regular.ttf", 30),
+        "medium": ("DMSans-Regular.ttf", 20),
+        "normal": ("DMSans-Regular.ttf", 56),
+        "large": ("DMSans-Regular.ttf", 82),
+        "xlarge": ("DMSans-Regular.ttf", 32),
+    },
+    "bold": {
+        "small": ("DMSans-Bold.ttf", 14),
+        "medium": ("DMSans-Bold.ttf", 20),
+        "normal": ("DMSans-Bold.ttf", 34),
+        "large": ("DMSans-Bold.ttf", 52),
+        "xlarge": ("DMSans-Bold.ttf", 36),
+    },
+    # Roboto Mono fonts remain unchanged
+    "roboto": {
+        "regular": ("RobotoMono-Regular.ttf", 24),
+        "bold": ("RobotoMono-Bold.ttf", 30),
+    },
+}
+
+TEMPLATE_FILES = {
+    "overview": "ReportOverview.png",
+    "detail": "Reports.png",
+    "additional": "AdditionalPage.png",
+}
+
+
+class ReportAssets:
+    """Fonts, decoded page templates and layout config shared by every ReportGenerator in the process"""
+
+    def __init__(self):
+        self.fonts = {
+            group: {
+                name: ImageFont.truetype(os.path.join(FONT_DIR, filename), size)
+                for name, (filename, size) in specs.items()
+            }
+            for group, specs in FONT_SPECS.items()
+        }
+        self.template_paths = {
+            key: os.path.join(TEMPLATE_DIR, filename) for key, filename in TEMPLATE_FILES.items()
+        }
+        # 模板预先去掉透明通道并以原始像素缓存（见 template_store），进程内 mmap 只读映射，每页从映射的像素复制
+        self.template_store = FlattenedTemplateStore()
+        self.templates = {
+            key: self.template_store.load(key, path) for key, path in self.template_paths.items()
+        }
+        with open(POS_CONFIG_PATH, "r") as f:
+            self.pos_config = json.load(f)
+
+    def new_page(self, template_key):
+        """Return a fresh, drawable RGB copy of a cached template"""
+        # RGBX -> RGB 只是一次内存复制
+        return self.templates[template_key].convert("RGB")
+
+
+_assets = None
+_assets_lock = threading.Lock()
+
+
+def get_report_assets():
+    """Load the report assets once per process"""
+    global _assets
+    if _assets is None:
+        with _assets_lock:
+            if _assets is None:
+                _assets = ReportAssets()
+                logger.info("Report assets loaded: fonts, templates and pos_config")
+    return _assets
+
+
+def preload_report_assets():
+    """在服务启动时预加载，避免第一个请求承担加载开销"""
+    return get_report_assets()
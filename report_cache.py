@@ -0,0 +1,176 @@
+import os
+import json
+import time
+import hashlib
+import logging
+import tempfile
+import threading
+from functools import lru_cache
+
+from report_assets import BASE_DIR, FONT_DIR, FONT_SPECS, POS_CONFIG_PATH, TEMPLATE_DIR, TEMPLATE_FILES
+
+logger = logging.getLogger(__name__)
+
+# 指纹格式变化时递增，使旧的缓存条目全部失效
+FINGERPRINT_VERSION = 2
+DEFAULT_CACHE_DIR = os.path.join(BASE_DIR, "report_cache")
+DEFAULT_MAX_ENTRIES = 1000
+DEFAULT_MAX_AGE = 7 * 24 * 3600
+
+
+def _canonical(value):
+    # Decimal / datetime 等按 str() 序列化，键排序保证同样的数据得到同样的字节
+    return json.dumps(value, sort_keys=True, default=str, separators=(",", ":")).encode()
+
+
+@lru_cache(maxsize=64)
+def _file_digest(path, mtime_ns, size):
+    # mtime/size 参与缓存键，文件修改后重新计算
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def asset_fingerprint():
+    """Digest of everything besides the data that changes a rendered report"""
+    paths = [POS_CONFIG_PATH]
+    paths += [os.path.join(TEMPLATE_DIR, filename) for filename in sorted(TEMPLATE_FILES.values())]
+    paths += sorted(
+        {os.path.join(FONT_DIR, filename) for specs in FONT_SPECS.values() for filename, _ in specs.values()}
+    )
+    # 税率影响 GST/PST 金额
+    paths.append(os.getenv("TAX_RATES_PATH", os.path.join(BASE_DIR, "tax_rates.json")))
+    digests = []
+    for path in paths:
+        stat = os.stat(path)
+        digests.append((os.path.basename(path), _file_digest(path, stat.st_mtime_ns, stat.st_size)))
+    return digests
+
+
+def fingerprint_report(
+    week_bill, store_info, order_digest, backend="raster", profile="archival", output_format="pdf"
+):
+    """sha256 over the order_bill_week row, store row, order digest, layout/template versions and output options
+
+    order_digest 为 DatabaseConnector.get_order_digest_by_store_and_period 的聚合结果（订单行摘要与
+    税目金额），命中缓存时不需要读取订单明细
+    """
+    return hashlib.sha256(_canonical({
+        "version": FINGERPRINT_VERSION,
+        "assets": asset_fingerprint(),
+        "bill": week_bill,
+        "store": store_info,
+        "orders": order_digest,
+        "backend": backend,
+        "profile": profile,
+        "format": output_format,
+    })).hexdigest()
+
+
+class ReportCache:
+    """Rendered reports keyed by fingerprint, one JSON entry per report
+
+    条目记录本地 PDF 路径和/或 S3 URL；超过 max_age 秒或条目数超过 max_entries（按最近访问淘汰）时删除，
+    同时删除条目对应的本地 PDF。S3 对象不删除，已发出的链接仍然有效。
+    """
+
+    def __init__(self, cache_dir=None, max_entries=None, max_age=None):
+        self.cache_dir = cache_dir or os.getenv("REPORT_CACHE_DIR", DEFAULT_CACHE_DIR)
+        self.max_entries = int(
+            max_entries if max_entries is not None else os.getenv("REPORT_CACHE_MAX_ENTRIES", DEFAULT_MAX_ENTRIES)
+        )
+        self.max_age = int(
+            max_age if max_age is not None else os.getenv("REPORT_CACHE_MAX_AGE", DEFAULT_MAX_AGE)
+        )
+        self._lock = threading.Lock()
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def _entry_path(self, fingerprint):
+        return os.path.join(self.cache_dir, f"{fingerprint}.json")
+
+    def _read(self, entry_path):
+        try:
+            with open(entry_path, "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def get(self, fingerprint, require_file=False):
+        """Return the cached entry or None; require_file 时本地 PDF 必须仍然存在"""
+        entry_path = self._entry_path(fingerprint)
+        entry = self._read(entry_path)
+        if entry is None:
+            return None
+        if time.time() - entry["created_at"] > self.max_age:
+            self._remove(entry_path, entry)
+            return None
+        has_file = bool(entry.get("path")) and os.path.exists(entry["path"])
+        if (require_file and not has_file) or not (has_file or entry.get("url")):
+            return None
+        # 条目文件的 mtime 作为最近访问时间，用于按条目数淘汰
+        try:
+            os.utime(entry_path)
+        except FileNotFoundError:
+            return None
+        logger.info(f"Report cache hit {fingerprint[:12]}: {entry.get('url') or entry.get('path')}")
+        return entry
+
+    def put(self, fingerprint, path=None, url=None, **meta):
+        """Record a rendered report (merged into an existing entry), then apply the eviction policy"""
+        entry = self._read(self._entry_path(fingerprint)) or {
+            "fingerprint": fingerprint, "path": None, "url": None, "created_at": time.time()
+        }
+        # 同一份报告先后由下载和邮件接口生成时，保留已有的 URL / 路径
+        entry.update({key: value for key, value in dict(path=path, url=url, **meta).items() if value is not None})
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, prefix=".entry.", suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump(entry, f, default=str)
+        os.replace(tmp_path, self._entry_path(fingerprint))
+        self.evict()
+        return entry
+
+    def _remove(self, entry_path, entry):
+        for path in (entry_path, (entry or {}).get("path")):
+            if path:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    # 其他 worker 已经删除
+                    pass
+
+    def evict(self):
+        """Drop expired entries, then the least recently used ones beyond max_entries"""
+        with self._lock:
+            now = time.time()
+            entries = []
+            for name in os.listdir(self.cache_dir):
+                if not name.endswith(".json"):
+                    continue
+                entry_path = os.path.join(self.cache_dir, name)
+                entry = self._read(entry_path)
+                if entry is None or now - entry.get("created_at", 0) > self.max_age:
+                    self._remove(entry_path, entry)
+                    continue
+                try:
+                    entries.append((os.path.getmtime(entry_path), entry_path, entry))
+                except FileNotFoundError:
+                    continue
+            entries.sort(key=lambda item: item[0])
+            for _, entry_path, entry in entries[: max(0, len(entries) - self.max_entries)]:
+                self._remove(entry_path, entry)
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_report_cache():
+    """Process-wide report cache"""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = ReportCache()
+    return _cache
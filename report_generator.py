@@ -1,17 +1,242 @@
 import os
-import json
-from PIL import Image, ImageDraw, ImageFont
-from reportlab.pdfgen import canvas
-from reportlab.lib.pagesizes import letter
-import PyPDF2
-import io
+import logging
+import threading
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from PIL import ImageDraw
 import math
+import itertools
 import datetime
 from decimal import Decimal  # 新增导入
+from order_record import as_order_records
+from report_assets import get_report_assets
+from pdf_writer import StreamingPdfWriter, encode_page, flatten_to_rgb
+from output_profiles import build_palette, get_profile
+from text_metrics import right_aligned_x, wrap_lines
+
+logger = logging.getLogger(__name__)
+
+# 23 orders per page
+ORDERS_PER_PAGE = 23
+# 定义 payment_method 映射
+PAYMENT_METHOD_MAP = {5: "Apple Pay", 7: "Card", 6: "Google Pay"}
+# 可选的渲染后端：raster 为 PIL 位图页面，vector 为 reportlab 矢量文字
+BACKENDS = ("raster", "vector")
+# 单份报告内详情页并行渲染：thread 或 process 池，workers <= 1 时按顺序渲染
+PAGE_EXECUTORS = ("thread", "process")
+
+
+class PageCountMismatchError(Exception):
+    """Raised when the streamed orders do not fill the page count implied by order_count"""
+
+
+def wrap_words(text, measure, max_width):
+    """根据最大像素宽度按单词换行，measure(text) 返回文字宽度"""
+    words = text.split()
+    lines = []
+    current_line = ""
+    for word in words:
+        test_line = current_line + (" " if current_line else "") + word
+        if measure(test_line) <= max_width:
+            current_line = test_line
+        else:
+            if current_line:
+                lines.append(current_line)
+            current_line = word
+    if current_line:
+        lines.append(current_line)
+    return lines
+
+
+def time_period_text(bill_data):
+    return f"{bill_data['start_date'].strftime('%B %d, %Y')} - {bill_data['end_date'].strftime('%B %d, %Y')}"
+
+
+def overview_values(bill_data):
+    """总览页的数值：(pos_config["overview"] 中的键, 数值, regular 字号)，数据导出直接使用数值"""
+    # Orders and store amount
+    total_store_amount = Decimal(bill_data["store_amount"]) + Decimal(
+        bill_data.get("extra_fee", 0)
+    )
+    # Stripe fee (negative value)
+    stripe_fee = Decimal(bill_data.get("stripe_fee", 0))
+    return [
+        ("store_amount", total_store_amount, "large"),
+        ("total_orders", bill_data["total_orders"], "large"),
+        # Sales
+        ("total_revenue", bill_data["total_revenue"], "normal"),
+        ("pickup_tip_fee", bill_data.get("pickup_tip_fee", 0.0), "normal"),
+        ("stripe_fee", -abs(stripe_fee), "normal"),
+        ("unique_users", bill_data.get("unique_users", 0), "large"),
+        # Total taxes
+        ("GST", bill_data.get("GST", 0), "normal"),
+        ("Additional_charge", bill_data.get("Additional_charge", 0), "normal"),
+        ("GST_total", bill_data.get("GST_total", 0), "normal"),
+        ("PST_total", bill_data.get("PST_total", 0), "normal"),
+    ]
+
+
+# 总览页中直接显示为整数的字段，其余按金额显示
+OVERVIEW_COUNT_FIELDS = ("total_orders", "unique_users")
+
+
+def overview_fields(bill_data):
+    """总览页的数值字段：(pos_config["overview"] 中的键, 文字, regular 字号)"""
+    fields = []
+    for key, value, size in overview_values(bill_data):
+        if key in OVERVIEW_COUNT_FIELDS:
+            text = str(value)
+        elif key == "stripe_fee":
+            text = f"$-{abs(value):.2f}"
+        else:
+            text = f"${value:.2f}"
+        fields.append((key, text, size))
+    return fields
+
+
+def order_final_price(order):
+    """计算最终金额及状态，每一行的金额不加小费"""
+    if order.refund_amount:
+        return order.store_total_fee - order.refund_amount, "Partial Refund"
+    return order.store_total_fee, "Completed"
+
+
+def detail_row_texts(order):
+    """一行订单明细：(pos_config["detail"] 中的列键, 文字)"""
+    final_price, status_text = order_final_price(order)
+    pay_value = order.payment_method
+    pay_text = PAYMENT_METHOD_MAP.get(pay_value, "") if (pay_value is not None) else ""
+    return (
+        ("order_date", order.created_at.strftime("%Y-%m-%d")),
+        # 用户姓名列，使用 order.user_name 替换原 user_id
+        ("order_user_id", str(order.user_name or "")),
+        ("pickup_code", str(order.pickup_code)),
+        ("order_amount", f"${final_price:.2f}"),
+        ("order_completed", status_text),
+        ("order_pay_type", pay_text),
+    )
+
+
+def has_additional_charges(bill_data):
+    """计算是否有额外费用"""
+    commission = abs(
+        Decimal(bill_data.get("commission_fee", 0))
+        - Decimal(bill_data.get("refund_commission_fee", 0))
+    )
+    service = abs(Decimal(bill_data.get("asset_balance_repayment", 0)))
+    extra = abs(Decimal(bill_data.get("extra_fee", 0)))
+    return commission > 0 or service > 0 or extra > 0
+
+
+def additional_charge_values(bill_data):
+    """额外费用：(pos_config["additional"] 中的费用键, 名称, 带符号金额, 日期文字)，扣款为负数"""
+    end_date_str = bill_data["end_date"].strftime("%B %d, %Y")
+    rows = []
+    if bill_data.get("commission_fee", 0) != 0:
+        amount = bill_data.get("commission_fee", 0) - bill_data.get(
+            "refund_commission_fee", 0
+        )
+        rows.append(("commission_fee", "Commission Fee", -amount, end_date_str))
+
+    if bill_data.get("asset_balance_repayment", 0) != 0:
+        rows.append(
+            (
+                "asset_balance_repayment",
+                "Service Package Fee",
+                -bill_data["asset_balance_repayment"],
+                end_date_str,
+            )
+        )
+    if bill_data.get("extra_fee", 0) != 0:
+        remark = bill_data.get("remark", "Extra Fee")
+        rows.append(("extra_fee", remark, bill_data["extra_fee"], end_date_str))
+    return rows
+
+
+def additional_rows(bill_data):
+    """额外费用行：(pos_config["additional"] 中的费用键, 名称, 金额文字, 日期文字)"""
+    rows = []
+    for fee_key, name, amount, date_text in additional_charge_values(bill_data):
+        # 扣款项显示为 $-金额
+        text = f"${amount:.2f}" if fee_key == "extra_fee" else f"$-{-amount:.2f}"
+        rows.append((fee_key, name, text, date_text))
+    return rows
+
+
+_page_executors = {}
+_page_executors_lock = threading.Lock()
+
+
+def process_pool_context():
+    """Start method for worker processes created while other threads are running
+
+    fork 会复制其他线程持有的锁（如日志 handler 的锁），子进程可能永久阻塞；
+    forkserver / spawn 从干净的进程启动 worker，worker 所需状态都通过任务参数传入。
+    """
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("forkserver")
+    return multiprocessing.get_context("spawn")
+
+
+def get_page_executor(kind, workers):
+    """Process-wide executor for detail page rendering, shared by every ReportGenerator"""
+    key = (kind, workers)
+    executor = _page_executors.get(key)
+    if executor is None:
+        with _page_executors_lock:
+            executor = _page_executors.get(key)
+            if executor is None:
+                if kind == "process":
+                    executor = ProcessPoolExecutor(
+                        max_workers=workers, mp_context=process_pool_context()
+                    )
+                else:
+                    executor = ThreadPoolExecutor(
+                        max_workers=workers, thread_name_prefix="report-page"
+                    )
+                _page_executors[key] = executor
+    return executor
+
+
+# 进程池 worker 内的渲染器与当前报告的详情页底图，每个进程只创建一次
+_worker_generator = None
+_worker_background = (None, None)
+
+
+def _render_detail_page_in_worker(
+    output_dir, bill_data, store_info, page_orders, page_number, overall_total, profile, palette
+):
+    """进程池任务：渲染一页详情页并编码，返回 EncodedPage
+
+    底图由任务参数中的 bill_data / store_info 生成并按报告缓存，调色板由父进程算好后传入，
+    不依赖 fork 继承的任何状态。
+    """
+    global _worker_generator, _worker_background
+    if _worker_generator is None:
+        _worker_generator = ReportGenerator(output_dir=output_dir)
+    key = (store_info["id"], bill_data["start_date"], bill_data["end_date"])
+    if _worker_background[0] != key:
+        _worker_background = (key, _worker_generator._detail_background(bill_data, store_info))
+    return _worker_generator._render_detail_page(
+        _worker_background[1], page_orders, page_number, overall_total, profile, palette
+    )
+
+
+def _detail_palette(background, profile):
+    # 调色板配置下，详情页统一使用底图算出的调色板
+    return build_palette(flatten_to_rgb(background), profile)
+
+
+def _palette_only(palette):
+    # quantize 只用到调色板图像的调色板，传给子进程时裁成 1x1，避免每页序列化整幅图像
+    return palette.crop((0, 0, 1, 1)) if palette is not None else None
 
 
 class ReportGenerator:
-    def __init__(self, output_dir=None):
+    def __init__(
+        self, output_dir=None, backend="raster", page_workers=None, page_executor=None, profile=None
+    ):
         # Create a timestamp-based reports folder if none specified
         if output_dir is None:
             timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
@@ -20,162 +245,220 @@ class ReportGenerator:
     )
         else:
             self.output_dir = output_dir
-        if not os.path.exists(self.output_dir):
-            os.makedirs(self.output_dir)
+        # 批量模式下多个进程同时创建同一目录
+        os.makedirs(self.output_dir, exist_ok=True)
         # Create subdirectories for organization
         self.pdf_dir = os.path.join(self.output_dir, "pdf_reports")
-        if not os.path.exists(self.pdf_dir):
-            os.makedirs(self.pdf_dir)
+        os.makedirs(self.pdf_dir, exist_ok=True)
         # Log the output directory
         print(f"Reports will be saved to: {self.output_dir}")
-        self.overview_template = os.path.join("report_template", "ReportOverview.png")
-        self.details_template = os.path.join("report_template", "Reports.png")
-        self.additional_template = os.path.join("report_template", "AdditionalPage.png")
-        # Define font styles with various sizes for different data, using DMSans for all except Roboto Mono
-        # 字体大小调整，适应模板
-        self.fonts = {
-            "regular": {
-                "small": ImageFont.truetype(
-                    os.path.join("fonts", "DMSans-Regular.ttf"), 30
-                ),
-                "medium": ImageFont.truetype(
-                    os.path.join("fonts", "DMSans-Regular.ttf"), 20
-                ),
-                "normal": ImageFont.truetype(
-                    os.path.join("fonts", "DMSans-Regular.ttf"), 56
-                ),
-                "large": ImageFont.truetype(
-                    os.path.join("fonts", "DMSans-Regular.ttf"), 82
-                ),
-                "xlarge": ImageFont.truetype(
-                    os.path.join("fonts", "DMSans-Regular.ttf"), 32
-                ),
-            },
-            "bold": {
-                "small": ImageFont.truetype(
-                    os.path.join("fonts", "DMSans-Bold.ttf"), 14
-                ),
-                "medium": ImageFont.truetype(
-                    os.path.join("fonts", "DMSans-Bold.ttf"), 20
-                ),
-                "normal": ImageFont.truetype(
-                    os.path.join("fonts", "DMSans-Bold.ttf"), 34
-                ),
-                "large": ImageFont.truetype(
-                    os.path.join("fonts", "DMSans-Bold.ttf"), 52
-                ),
-                "xlarge": ImageFont.truetype(
-                    os.path.join("fonts", "DMSans-Bold.ttf"), 36
-                ),
-            },
-            # Roboto Mono fonts remain unchanged
-            # 确保字体文件存在
-            "roboto": {
-                "regular": ImageFont.truetype(
-                    os.path.join("fonts", "RobotoMono-Regular.ttf"), 24
-                ),
-                "bold": ImageFont.truetype(
-                    os.path.join("fonts", "RobotoMono-Bold.ttf"), 30
-                ),
-            },
-        }
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown report backend {backend!r}, expected one of {BACKENDS}")
+        self.backend = backend
+        self.page_workers = int(
+            page_workers if page_workers is not None else os.getenv("REPORT_PAGE_WORKERS", 1)
+        )
+        self.page_executor = page_executor or os.getenv("REPORT_PAGE_EXECUTOR", "thread")
+        if self.page_executor not in PAGE_EXECUTORS:
+            raise ValueError(
+                f"Unknown page executor {self.page_executor!r}, expected one of {PAGE_EXECUTORS}"
+            )
+        # 输出配置 archival / email / preview，generate_report 可按次覆盖
+        self.profile = get_profile(profile)
+        # 字体、模板与坐标配置在进程内只加载一次，见 report_assets
+        self.assets = get_report_assets()
+        self.overview_template = self.assets.template_paths["overview"]
+        self.details_template = self.assets.template_paths["detail"]
+        self.additional_template = self.assets.template_paths["additional"]
+        self.fonts = self.assets.fonts
         # For backward compatibility with existing code
         # 设置默认字体
         self.font_regular = self.fonts["regular"]["normal"]
         self.font_bold = self.fonts["bold"]["normal"]
         self.font_small = self.fonts["regular"]["small"]
 
+        # Position configuration from pos_config.json
+        self.pos_config = self.assets.pos_config
 
-        # Load position configuration from JSON file
-        config_path = os.path.join(os.path.dirname(__file__), "pos_config.json")
-        with open(config_path, "r") as f:
-            self.pos_config = json.load(f)
-
+        self._vector_renderer = None
+        if backend == "vector":
+            # reportlab 只在使用矢量后端时加载
+            from vector_renderer import VectorReportRenderer
+            self._vector_renderer = VectorReportRenderer(self.assets)
 
+    def generate_report(self, bill_data, store_info, orders, order_count=None, profile=None):
+        """Generate complete report PDF for a merchant
 
-    def generate_report(self, bill_data, store_info, orders):
-        """Generate complete report PDF for a merchant"""
-        store_name = store_info["name"]
-
-        # store_info = db.get_store_info(store_id)
-        
+        orders 可以是列表，也可以是流式迭代器（如 DatabaseConnector.iter_orders_by_store_and_period），
+        后者需要同时传入已过滤的订单数 order_count，订单不会被整体读入内存。
+        profile 为输出配置名（见 output_profiles），默认使用构造时的配置
+        """
+        profile = get_profile(profile) if profile is not None else self.profile
         report_id = (
             f"report_{store_info['id']}_{bill_data['start_date'].strftime('%Y%m%d')}"
         )
+        pdf_path = os.path.join(self.pdf_dir, f"{report_id}.pdf")
 
-        # Generate overview page
-
-        overview_page = self._generate_overview_page(bill_data, store_info)
+        # 转换为 OrderRecord 并只过滤一次 (payment_method != 4 且 state == 5000)，后续阶段共用
+        orders = as_order_records(orders)
+        # 提前计算详情页总数
+        if order_count is None:
+            orders = list(orders)
+            order_count = len(orders)
+        detail_count = math.ceil(order_count / ORDERS_PER_PAGE)
 
+        has_additional = has_additional_charges(bill_data)
+        overall_total = 1 + detail_count + (1 if has_additional else 0)
 
-        # 提前过滤订单，计算详情页总数
+        if self.backend == "vector":
+            self._vector_renderer.render(
+                pdf_path, bill_data, store_info, orders, overall_total, has_additional, profile
+            )
+            return pdf_path
 
-        filtered_orders = [
-            order
-            for order in orders
-            if (order.get("payment_method") != 4 and order.get("state") == 5000)
-            # 过滤 payment_method == 4 的订单 (4: Cash)，并且状态为 5000 (已完成)
-        ]
-        detail_count = math.ceil(len(filtered_orders) / 23)
-        # 23 orders per page
+        with StreamingPdfWriter(pdf_path) as pdf_writer:
+            if self.page_workers > 1 and detail_count > 1:
+                self._write_pages_parallel(
+                    pdf_writer, bill_data, store_info, orders, has_additional, overall_total, profile
+                )
+            else:
+                # 流式生成：每页渲染、加页码、编码写入后再生成下一页，内存中最多只保留一页
+                pages = self._iter_pages(
+                    bill_data, store_info, orders, has_additional, overall_total, profile
+                )
+                for page_number, (img, palette) in enumerate(pages, start=1):
+                    self._draw_page_number(img, page_number, overall_total)
+                    try:
+                        pdf_writer.add_page(img, profile=profile, palette=palette)
+                    except Exception as e:
+                        logger.error(f"处理第{page_number}页时出错: {str(e)}")
+                        raise
+            if pdf_writer.page_count != overall_total:
+                # order_count 与实际流出的订单数不一致（统计与读取之间订单有变化）时页码分母错误，
+                # 在 with 内抛出，临时文件被丢弃，不会发布页码错误的 PDF
+                raise PageCountMismatchError(
+                    f"{report_id}: expected {overall_total} pages from order_count, "
+                    f"rendered {pdf_writer.page_count}"
+                )
 
-        # 计算是否有额外费用
-        commission = abs(
-            Decimal(bill_data.get("commission_fee", 0))
-            - Decimal(bill_data.get("refund_commission_fee", 0))
+        logger.info(
+            f"PDF成功保存到: {pdf_path}，共{pdf_writer.page_count}页，配置 {profile.name}，"
+            f"文件大小: {os.path.getsize(pdf_path)}字节"
         )
-        service = abs(Decimal(bill_data.get("asset_balance_repayment", 0)))
-        extra = abs(Decimal(bill_data.get("extra_fee", 0)))
-        has_additional = commission > 0 or service > 0 or extra > 0
-        overall_total = 1 + detail_count + (1 if has_additional else 0)
-
+        return pdf_path
 
-        # 生成详情页，向后传入整体页数
-        detail_pages = self._generate_detail_pages(
-            bill_data, store_info, orders, overall_total
-        )
-        pages = [overview_page] + detail_pages
-        # 生成额外费用页
+    def _iter_pages(
+        self, bill_data, store_info, orders, has_additional, overall_total, profile=None
+    ):
+        """按顺序逐页生成未加页码的页面 (img, palette)：总览页、详情页、额外费用页"""
+        yield self._generate_overview_page(bill_data, store_info), None
+        detail_count = 0
+        background = palette = None
+        for page_orders in self._iter_order_chunks(orders):
+            if background is None:
+                background = self._detail_background(bill_data, store_info)
+                if profile is not None:
+                    palette = _detail_palette(background, profile)
+            detail_count += 1
+            yield self._detail_page(background, page_orders), palette
         if has_additional:
-            additional_page = self._generate_additional_page(
+            yield self._generate_additional_page(
                 bill_data, store_info, detail_count + 2, overall_total
+            ), None
+
+    def _write_pages_parallel(
+        self, pdf_writer, bill_data, store_info, orders, has_additional, overall_total, profile
+    ):
+        """详情页在线程/进程池中渲染并编码，按页序写入；同时在途的页数有上限，内存仍然有界"""
+        executor = get_page_executor(self.page_executor, self.page_workers)
+        max_pending = self.page_workers * 2
+
+        overview = self._generate_overview_page(bill_data, store_info)
+        self._draw_page_number(overview, 1, overall_total)
+        pdf_writer.add_page(overview, profile=profile)
+        del overview
+
+        background = palette = None
+        if self.page_executor == "thread":
+            background = self._detail_background(bill_data, store_info)
+            palette = _detail_palette(background, profile)
+        elif profile.mode == "P":
+            # 调色板在父进程算一次，各 worker 使用同一份
+            palette = _palette_only(
+                _detail_palette(self._detail_background(bill_data, store_info), profile)
             )
-            pages.append(additional_page)
+        pending = deque()
+        page_number = 2
+        try:
+            for page_orders in self._iter_order_chunks(orders):
+                if self.page_executor == "process":
+                    future = executor.submit(
+                        _render_detail_page_in_worker,
+                        self.output_dir,
+                        bill_data,
+                        store_info,
+                        page_orders,
+                        page_number,
+                        overall_total,
+                        profile,
+                        palette,
+                    )
+                else:
+                    future = executor.submit(
+                        self._render_detail_page,
+                        background,
+                        page_orders,
+                        page_number,
+                        overall_total,
+                        profile,
+                        palette,
+                    )
+                pending.append(future)
+                page_number += 1
+                if len(pending) >= max_pending:
+                    pdf_writer.add_encoded_page(pending.popleft().result())
+            while pending:
+                pdf_writer.add_encoded_page(pending.popleft().result())
+        finally:
+            for future in pending:
+                future.cancel()
 
-        # 在合并为 PDF 之前添加页码
-        pages = self._add_page_numbers(pages)
+        if has_additional:
+            additional = self._generate_additional_page(
+                bill_data, store_info, page_number, overall_total
+            )
+            self._draw_page_number(additional, page_number, overall_total)
+            pdf_writer.add_page(additional, profile=profile)
 
-        # Combine pages into a PDF
-        pdf_path = os.path.join(self.pdf_dir, f"{report_id}.pdf")
-        self._combine_pages_to_pdf(pages, pdf_path)
-        return pdf_path
+    def _render_detail_page(
+        self, background, page_orders, page_number, overall_total, profile=None, palette=None
+    ):
+        """Render and encode one detail page from the per-report background"""
+        img = self._detail_page(background, page_orders)
+        self._draw_page_number(img, page_number, overall_total)
+        return encode_page(img, profile=profile, palette=palette)
+
+    def _draw_page_number(self, img, page_number, overall_total):
+        # 使用 detail 中的 page_number 坐标
+        pos = self.pos_config["detail"]["page_number"]
+        ImageDraw.Draw(img).text(
+            (pos["x"], pos["y"]),
+            f"Page {page_number}/{overall_total}",
+            fill="black",
+            font=self.fonts["regular"]["small"],
+        )
+
+    def _wrap_text(self, text, font, max_width, draw=None):
+        """根据最大像素宽度进行换行，宽度测量走 text_metrics 缓存"""
+        return "\n".join(wrap_lines(text, font, max_width))
 
     def _generate_overview_page(self, bill_data, store_info):
-        img = Image.open(self.overview_template)
+        img = self.assets.new_page("overview")
         draw = ImageDraw.Draw(img)
-        import textwrap
-
-        # 定义辅助函数，根据最大像素宽度进行换行
-        def wrap_text(text, font, max_width, draw):
-            words = text.split()
-            lines = []
-            current_line = ""
-            for word in words:
-                test_line = current_line + (" " if current_line else "") + word
-                w, _ = draw.textsize(test_line, font=font)
-                if w <= max_width:
-                    current_line = test_line
-                else:
-                    if current_line:
-                        lines.append(current_line)
-                    current_line = word
-            if current_line:
-                lines.append(current_line)
-            return "\n".join(lines)
 
         # --- 绘制商户名称（最大宽度500） ---
         pos_name = self.pos_config["overview"]["store_name"]
-        wrapped_name = wrap_text(
+        wrapped_name = self._wrap_text(
             store_info["name"], self.fonts["regular"]["small"], 500, draw
         )
         draw.multiline_text(
@@ -200,7 +483,7 @@ class ReportGenerator:
 
         # --- 绘制店铺地址（最大宽度1000） ---
         pos_address = self.pos_config["overview"]["store_address"]
-        wrapped_address = wrap_text(
+        wrapped_address = self._wrap_text(
             store_info["address"], self.fonts["regular"]["small"], 1000, draw
         )
         draw.multiline_text(
@@ -211,245 +494,84 @@ class ReportGenerator:
             spacing=4,
         )
 
-        # --- 其余绘制保持不变 ---
-
         # --- 绘制总览数据 ---
+        for key, text, size in overview_fields(bill_data):
+            pos = self.pos_config["overview"][key]
+            draw.text(
+                (pos["x"], pos["y"]),
+                text,
+                fill="black",
+                font=self.fonts["regular"][size],
+            )
 
-        # Orders and store amount
-        pos = self.pos_config["overview"]["store_amount"]
-        total_store_amount = Decimal(bill_data["store_amount"]) + Decimal(
-            bill_data.get("extra_fee", 0)
-        )
-        draw.text(
-            (pos["x"], pos["y"]),
-            f"${total_store_amount:.2f}",
-            fill="black",
-            font=self.fonts["regular"]["large"],
-        )
-        pos = self.pos_config["overview"]["total_orders"]
-        draw.text(
-            (pos["x"], pos["y"]),
-            str(bill_data["total_orders"]),
-            fill="black",
-            font=self.fonts["regular"]["large"],
-        )
-
-        # Sales
-        pos = self.pos_config["overview"]["total_revenue"]
-        draw.text(
-            (pos["x"], pos["y"]),
-            f"${bill_data['total_revenue']:.2f}",
-            fill="black",
-            font=self.fonts["regular"]["normal"],
-        )
-
-        # Pickup tip fee
-        pos = self.pos_config["overview"]["pickup_tip_fee"]
-        pickup_tip_fee = bill_data.get("pickup_tip_fee", 0.0)
-        draw.text(
-            (pos["x"], pos["y"]),
-            f"${pickup_tip_fee:.2f}",
-            fill="black",
-            font=self.fonts["regular"]["normal"],
-        )
-        
-        # Stripe fee (negative value)
-        pos = self.pos_config["overview"]["stripe_fee"]
-        stripe_fee = Decimal(bill_data.get("stripe_fee", 0))
-        draw.text(
-            (pos["x"], pos["y"]),
-            f"$-{abs(stripe_fee):.2f}",
-            fill="black",
-            font=self.fonts["regular"]["normal"],
-        )
+        return img
 
-        # Unique users
-        pos = self.pos_config["overview"]["unique_users"]
-        unique_users = bill_data.get("unique_users", 0)
-        draw.text(
-            (pos["x"], pos["y"]),
-            str(unique_users),
-            fill="black",
-            font=self.fonts["regular"]["large"],
-        )
+    def _detail_background(self, bill_data, store_info):
+        """每份报告只渲染一次的详情页底图：模板 + 右对齐的商户名称与时间段"""
+        img = self.assets.new_page("detail")
+        draw = ImageDraw.Draw(img)
+        # 获取图片宽度
+        img_width, _ = img.size
+        right_margin = 100  # 保留右侧100像素边距
 
-        # Total taxes
-        pos = self.pos_config["overview"]["GST"]
-        draw.text(
-            (pos["x"], pos["y"]),
-            f"${bill_data.get('GST', 0):.2f}",
-            fill="black",
-            font=self.fonts["regular"]["normal"],
+        # -- 绘制商户名称右对齐 --
+        store_name_text = store_info["name"]
+        x_aligned = right_aligned_x(
+            self.fonts["regular"]["small"], store_name_text, img_width, right_margin
         )
-
-        # Additional charge
-        pos = self.pos_config["overview"]["Additional_charge"]
+        # 使用配置中的 y 坐标
+        pos_name = self.pos_config["detail"]["store_name"]
         draw.text(
-            (pos["x"], pos["y"]),
-            f"${bill_data.get('Additional_charge', 0):.2f}",
+            (x_aligned, pos_name["y"]),
+            store_name_text,
             fill="black",
-            font=self.fonts["regular"]["normal"],
+            font=self.fonts["regular"]["small"],
         )
 
-        # Total GST
-        pos = self.pos_config["overview"]["GST_total"]
-        draw.text(
-            (pos["x"], pos["y"]),
-            f"${bill_data.get('GST_total', 0):.2f}",
-            fill="black",
-            font=self.fonts["regular"]["normal"],
+        # -- 绘制时间段右对齐 --
+        time_text = time_period_text(bill_data)
+        x_aligned_time = right_aligned_x(
+            self.fonts["regular"]["small"], time_text, img_width, right_margin
         )
-
-        # Total PST
-        pos = self.pos_config["overview"]["PST_total"]
+        pos_time = self.pos_config["detail"]["time_period"]
         draw.text(
-            (pos["x"], pos["y"]),
-            f"${bill_data.get('PST_total', 0):.2f}",
+            (x_aligned_time, pos_time["y"]),
+            time_text,
             fill="black",
-            font=self.fonts["regular"]["normal"],
+            font=self.fonts["regular"]["small"],
         )
-
         return img
 
-    def _generate_detail_pages(self, bill_data, store_info, orders, overall_total):
-        """Generate detail report pages for orders, 23 orders per page"""
-        pages = []
-        orders_per_page = 23
-        # 过滤 payment_method == 4 的订单 (4: Cash)，并且状态为 5000 (已完成)
-        filtered_orders = [
-            order
-            for order in orders
-            if (order.get("payment_method") != 4 and order.get("state") == 5000)
-        ]
-        total_pages = math.ceil(len(filtered_orders) / orders_per_page)
-
-        # 定义 payment_method 映射
-        payment_method_map = {5: "Apple Pay", 7: "Card", 6: "Google Pay"}
-        for page_num in range(total_pages):
-            img = Image.open(self.details_template)
-            draw = ImageDraw.Draw(img)
-            # 获取图片宽度
-            img_width, _ = img.size
-            right_margin = 100  # 保留右侧100像素边距
-
-            # -- 绘制商户名称右对齐 --
-            store_name_text = store_info["name"]
-            text_width, _ = draw.textsize(
-                store_name_text, font=self.fonts["regular"]["small"]
-            )
-            x_aligned = img_width - text_width - right_margin
-            # 使用配置中的 y 坐标
-            pos_name = self.pos_config["detail"]["store_name"]
-            draw.text(
-                (x_aligned, pos_name["y"]),
-                store_name_text,
-                fill="black",
-                font=self.fonts["regular"]["small"],
-            )
-
-            # -- 绘制时间段右对齐 --
-            time_text = f"{bill_data['start_date'].strftime('%B %d, %Y')} - {bill_data['end_date'].strftime('%B %d, %Y')}"
-            text_width_time, _ = draw.textsize(
-                time_text, font=self.fonts["regular"]["small"]
-            )
-            x_aligned_time = img_width - text_width_time - right_margin
-            pos_time = self.pos_config["detail"]["time_period"]
-            draw.text(
-                (x_aligned_time, pos_time["y"]),
-                time_text,
-                fill="black",
-                font=self.fonts["regular"]["small"],
-            )
+    def _iter_order_chunks(self, orders):
+        """Slice (possibly streaming) orders into lists of ORDERS_PER_PAGE"""
+        # orders 为已过滤的 OrderRecord，可以是流式迭代器，逐页读取
+        filtered_orders = iter(orders)
+        while True:
+            page_orders = list(itertools.islice(filtered_orders, ORDERS_PER_PAGE))
+            if not page_orders:
+                return
+            yield page_orders
+
+    def _detail_page(self, background, page_orders):
+        # 每页从底图 copy()，只绘制订单行
+        img = background.copy()
+        self._draw_detail_rows(img, page_orders)
+        return img
 
-            # --- 其余部分保持不变 ---
-            pos = self.pos_config["detail"]["page_number"]
-            draw.text(
-                (pos["x"], pos["y"]),
-                f"Page {page_num + 2}/{overall_total}",
-                fill="black",
-                font=self.fonts["regular"]["small"],
-            )
-            # 取本页订单（过滤后）
-            start_idx = page_num * orders_per_page
-            end_idx = min(((page_num + 1) * orders_per_page), len(filtered_orders))
-            page_orders = filtered_orders[start_idx:end_idx]
-            y_pos = self.pos_config["detail"]["order_start_y"]
-            y_increment = self.pos_config["detail"]["order_y_increment"]
-            for i, order in enumerate(page_orders):
-                row_y = y_pos + (i * y_increment)
-                # Order date column
-                pos = self.pos_config["detail"]["order_date"]
-                draw.text(
-                    (pos["x"], row_y),
-                    order["created_at"].strftime("%Y-%m-%d"),
-                    fill="black",
-                    font=self.fonts["roboto"]["bold"],
-                )
-                # 用户姓名列，使用 order['user_name'] 替换原 user_id
-                pos = self.pos_config["detail"]["order_user_id"]
-                draw.text(
-                    (pos["x"], row_y),
-                    str(order.get("user_name", "")),
-                    fill="black",
-                    font=self.fonts["roboto"]["bold"],
-                )
-                # Pickup code column
-                pos = self.pos_config["detail"]["pickup_code"]
-                draw.text(
-                    (pos["x"], row_y),
-                    str(order["pickup_code"]),
-                    fill="black",
-                    font=self.fonts["roboto"]["bold"],
-                )
-                # 计算最终金额及状态：
-                tip = order.get("tip_fee", 0)
-                refund = order.get("refund_amount", 0)
-                channel = order.get("channel", 1)  # 默认1: 非取货
-                if refund:
-                    final_price = order["store_total_fee"] - refund
-                    status_text = "Partial Refund"
-                else:
-                    final_price = order["store_total_fee"]
-                    status_text = "Completed"
-                '''
-                if channel == 2:
-                    final_price += tip
-                # 每一行的金额不加小费
-                '''
-
-                # Order amount column with final price
-                pos = self.pos_config["detail"]["order_amount"]
-                amount_text = f"${final_price:.2f}"
-                draw.text(
-                    (pos["x"], row_y),
-                    amount_text,
-                    fill="black",
-                    font=self.fonts["roboto"]["bold"],
-                )
-                # Draw status text (Final refund/completion status)
-                pos = self.pos_config["detail"]["order_completed"]
-                draw.text(
-                    (pos["x"], row_y),
-                    status_text,
-                    fill="black",
-                    font=self.fonts["roboto"]["bold"],
-                )
-                # Payment method column (映射支付名称)
-                pos = self.pos_config["detail"]["order_pay_type"]
-                pay_value = order.get("payment_method")
-                pay_text = (
-                    payment_method_map.get(pay_value, "")
-                    if (pay_value is not None)
-                    else ""
-                )
+    def _draw_detail_rows(self, img, page_orders):
+        draw = ImageDraw.Draw(img)
+        y_pos = self.pos_config["detail"]["order_start_y"]
+        y_increment = self.pos_config["detail"]["order_y_increment"]
+        for i, order in enumerate(page_orders):
+            row_y = y_pos + (i * y_increment)
+            for column, text in detail_row_texts(order):
+                pos = self.pos_config["detail"][column]
                 draw.text(
                     (pos["x"], row_y),
-                    pay_text,
+                    text,
                     fill="black",
                     font=self.fonts["roboto"]["bold"],
                 )
-            pages.append(img)
-        return pages
 
     def _generate_additional_page(
         self, bill_data, store_info, page_number, overall_total
@@ -457,7 +579,7 @@ class ReportGenerator:
         """Generate additional charge page based on non-zero additional charge values"""
         # 添加日志帮助调试模板文件路径
         print(f"Generating additional page using template: {self.additional_template}")
-        img = Image.open(self.additional_template)
+        img = self.assets.new_page("additional")
         draw = ImageDraw.Draw(img)
         pos_config = self.pos_config["additional"]
 
@@ -466,10 +588,9 @@ class ReportGenerator:
 
         # Merchant name right aligned
         merchant_text = store_info["name"]
-        merchant_text_width, _ = draw.textsize(
-            merchant_text, font=self.fonts["regular"]["small"]
+        merchant_x = right_aligned_x(
+            self.fonts["regular"]["small"], merchant_text, img_width, right_margin
         )
-        merchant_x = img_width - merchant_text_width - right_margin
         draw.text(
             (merchant_x, pos_config["merchant_name"]["y"]),
             merchant_text,
@@ -478,11 +599,10 @@ class ReportGenerator:
         )
 
         # Time period right aligned
-        time_period_str = f"{bill_data['start_date'].strftime('%B %d, %Y')} - {bill_data['end_date'].strftime('%B %d, %Y')}"
-        time_text_width, _ = draw.textsize(
-            time_period_str, font=self.fonts["regular"]["small"]
+        time_period_str = time_period_text(bill_data)
+        time_x = right_aligned_x(
+            self.fonts["regular"]["small"], time_period_str, img_width, right_margin
         )
-        time_x = img_width - time_text_width - right_margin
         draw.text(
             (time_x, pos_config["time_period"]["y"]),
             time_period_str,
@@ -490,144 +610,19 @@ class ReportGenerator:
             font=self.fonts["regular"]["small"],
         )
 
-        # 定义 end_date_str 供后续使用
-        end_date_str = bill_data["end_date"].strftime("%B %d, %Y")
-
-        # 准备额外费用数据行，使用 roboto 字体绘制
-        rows = []
-        if bill_data.get("commission_fee", 0) != 0:
-            amount = bill_data.get("commission_fee", 0) - bill_data.get(
-                "refund_commission_fee", 0
-            )
-            rows.append(("Commission Fee", f"$-{amount:.2f}", end_date_str))
-
-        if bill_data.get("asset_balance_repayment", 0) != 0:
-            rows.append(
-                (
-                    "Service Package Fee",
-                    f"$-{bill_data['asset_balance_repayment']:.2f}",
-                    end_date_str,
-                )
-            )
-        if bill_data.get("extra_fee", 0) != 0:
-            remark = bill_data.get("remark", "Extra Fee")
-            rows.append((remark, f"${bill_data['extra_fee']:.2f}", end_date_str))
-
         # 绘制每一行（名称、金额、日期）以配置中的横坐标绘制，行的 y 坐标递增
         base_y = pos_config["row_start_y"]
         increment = pos_config["row_y_increment"]
-        for i, (name, amount, date_text) in enumerate(rows):
+        for i, (fee_key, name, amount, date_text) in enumerate(additional_rows(bill_data)):
             row_y = base_y + (i * increment)
-            # Commission row：名称使用 pos_config["commission_fee"]["name"]等（其它行类似）
             # 根据费用类型选择对应的 x 坐标
-            if name in ["Commission Fee"]:
-                name_x = pos_config["commission_fee"]["name"]["x"]
-                amount_x = pos_config["commission_fee"]["amount"]["x"]
-                date_x = pos_config["commission_fee"]["date"]["x"]
-            elif name in ["Service Package Fee"]:
-                name_x = pos_config["asset_balance_repayment"]["name"]["x"]
-                amount_x = pos_config["asset_balance_repayment"]["amount"]["x"]
-                date_x = pos_config["asset_balance_repayment"]["date"]["x"]
-            else:
-                name_x = pos_config["extra_fee"]["name"]["x"]
-                amount_x = pos_config["extra_fee"]["amount"]["x"]
-                date_x = pos_config["extra_fee"]["date"]["x"]
-            draw.text(
-                (name_x, row_y), name, fill="black", font=self.fonts["roboto"]["bold"]
-            )
-            draw.text(
-                (amount_x, row_y),
-                amount,
-                fill="black",
-                font=self.fonts["roboto"]["bold"],
-            )
-            draw.text(
-                (date_x, row_y),
-                date_text,
-                fill="black",
-                font=self.fonts["roboto"]["bold"],
-            )
+            fee_pos = pos_config[fee_key]
+            for column, text in (("name", name), ("amount", amount), ("date", date_text)):
+                draw.text(
+                    (fee_pos[column]["x"], row_y),
+                    text,
+                    fill="black",
+                    font=self.fonts["roboto"]["bold"],
+                )
 
         return img
-
-    def _combine_pages_to_pdf(self, images, output_path):
-        """将PIL图像列表转换为单个PDF文件，加强图像处理和文件操作安全性"""
-        import time
-        import logging
-        
-        logger = logging.getLogger(__name__)
-        logger.info(f"开始合并{len(images)}个页面到PDF: {output_path}")
-        
-        pdf_writer = PyPDF2.PdfWriter()
-        
-        for i, img in enumerate(images):
-            logger.info(f"处理第{i+1}页，图像模式: {img.mode}, 尺寸: {img.size}")
-            
-            # 增强图像格式转换逻辑，处理所有可能的透明通道情况
-            if img.mode == "RGBA" or img.mode == "LA":
-                logger.info(f"将第{i+1}页从{img.mode}转换为RGB模式")
-                # 创建白色背景
-                bg = Image.new("RGB", img.size, (255, 255, 255))
-                if img.mode == "RGBA":
-                    # 使用alpha通道作为遮罩
-                    bg.paste(img, (0, 0), img.split()[3])
-                else:  # LA模式
-                    bg.paste(img, (0, 0), img.split()[1])
-                img = bg
-            elif img.mode != "RGB":
-                logger.info(f"将第{i+1}页从{img.mode}转换为RGB模式")
-                img = img.convert("RGB")
-                
-            # 保存为临时PDF字节流
-            img_byte_arr = io.BytesIO()
-            try:
-                img.save(img_byte_arr, format="PDF")
-                img_byte_arr.seek(0)
-                
-                # 读取PDF并添加到最终文档
-                pdf_reader = PyPDF2.PdfReader(img_byte_arr)
-                pdf_writer.add_page(pdf_reader.pages[0])
-                logger.info(f"第{i+1}页已添加到PDF")
-            except Exception as e:
-                logger.error(f"处理第{i+1}页时出错: {str(e)}")
-                raise
-        
-        # 创建输出目录（如果不存在）
-        os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
-        
-        # 写入PDF文件
-        try:
-            with open(output_path, "wb") as f:
-                pdf_writer.write(f)
-            
-            # 确保文件完全写入磁盘
-            time.sleep(0.1)
-            logger.info(f"PDF成功保存到: {output_path}，共{len(images)}页")
-            
-            # 验证文件已成功写入
-            if os.path.exists(output_path):
-                file_size = os.path.getsize(output_path)
-                logger.info(f"已确认文件写入，文件大小: {file_size}字节")
-            else:
-                logger.warning(f"文件写入验证失败，无法找到: {output_path}")
-        except Exception as e:
-            logger.error(f"保存PDF时出错: {str(e)}")
-            raise
-            
-        return output_path
-
-    def _add_page_numbers(self, pages):
-        """在所有页面添加页码"""
-        total_pages = len(pages)
-        for i, img in enumerate(pages):
-            draw = ImageDraw.Draw(img)
-            page_num = i + 1
-            # 使用 detail 中的 page_number 坐标
-            pos = self.pos_config["detail"]["page_number"]
-            draw.text(
-                (pos["x"], pos["y"]),
-                f"Page {page_num}/{total_pages}",
-                fill="black",
-                font=self.fonts["regular"]["small"],
-            )
-        return pages
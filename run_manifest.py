@@ -0,0 +1,120 @@
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_NAME = "manifest.jsonl"
+
+STATUS_PENDING = "pending"
+STATUS_DONE = "done"
+STATUS_FAILED = "failed"
+
+
+def bill_key(bill):
+    """Identify a bill across runs by store and billing period"""
+    return f"{bill['store_id']}:{bill['start_date']:%Y-%m-%d}:{bill['end_date']:%Y-%m-%d}"
+
+
+def bill_checksum(bill):
+    """sha256 of the order_bill_week row; a changed row is rendered again on resume"""
+    # Decimal / datetime 按 str() 序列化，键排序保证同一行得到同样的摘要
+    payload = json.dumps(bill, sort_keys=True, default=str, separators=(",", ":"))
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class RunManifest:
+    """Append-only per-bill journal of a batch run, stored as manifest.jsonl in the batch directory
+
+    每行一条记录（pending / done / failed），同一账单以最后一条为准；每条记录写入后立即 fsync，
+    进程崩溃最多丢失正在写的一行，读取时忽略不完整的行。
+    """
+
+    def __init__(self, batch_dir, output_format="pdf", name=MANIFEST_NAME):
+        self.batch_dir = batch_dir
+        # 续跑时换了输出格式，之前的结果不算完成
+        self.output_format = output_format
+        # 分片运行时每个分片一个文件，见 sharding.manifest_name
+        self.path = os.path.join(batch_dir, name)
+        self._lock = threading.Lock()
+        # 上次写到一半的行没有换行符，续写前先补上，避免与新记录连成一行
+        self._needs_newline = False
+        self.entries = self._load()
+
+    def _load(self):
+        entries = {}
+        if not os.path.exists(self.path):
+            return entries
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line_number, line in enumerate(f, 1):
+                self._needs_newline = not line.endswith("\n")
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    logger.warning(f"Skipping unreadable manifest line {line_number} in {self.path}")
+                    continue
+                entries[entry["key"]] = entry
+        return entries
+
+    def _append(self, entries):
+        os.makedirs(self.batch_dir, exist_ok=True)
+        data = "".join(json.dumps(entry, default=str, ensure_ascii=False) + "\n" for entry in entries)
+        with self._lock:
+            if self._needs_newline:
+                data = "\n" + data
+                self._needs_newline = False
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            for entry in entries:
+                self.entries[entry["key"]] = entry
+
+    def is_done(self, bill):
+        """True when the bill finished in an earlier run, its row is unchanged and its output still exists"""
+        entry = self.entries.get(bill_key(bill))
+        return (
+            entry is not None
+            and entry["status"] == STATUS_DONE
+            and entry["checksum"] == bill_checksum(bill)
+            and entry.get("format") == self.output_format
+            and bool(entry.get("report_path"))
+            and os.path.exists(entry["report_path"])
+        )
+
+    def mark_pending(self, bills):
+        """Record the bills this run is about to process"""
+        now = time.time()
+        self._append([
+            {
+                "key": bill_key(bill),
+                "store_id": bill["store_id"],
+                "checksum": bill_checksum(bill),
+                "status": STATUS_PENDING,
+                "updated_at": now,
+            }
+            for bill in bills
+        ])
+
+    def record(self, bill, result):
+        """Record the outcome of one bill (a process_bundle result)"""
+        entry = dict(result)
+        entry.update(
+            key=bill_key(bill),
+            checksum=bill_checksum(bill),
+            format=self.output_format,
+            status=STATUS_FAILED if result["error"] else STATUS_DONE,
+            updated_at=time.time(),
+        )
+        self._append([entry])
+
+    def result(self, bill):
+        """The recorded result of a completed bill, in the shape process_bundle returns"""
+        entry = self.entries[bill_key(bill)]
+        return {
+            key: entry.get(key)
+            for key in ("store_id", "store_name", "report_path", "url", "error", "elapsed")
+        }
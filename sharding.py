@@ -0,0 +1,163 @@
+import os
+import json
+import glob
+import logging
+
+from batch_plan import stable_hash
+from run_manifest import MANIFEST_NAME, STATUS_DONE, STATUS_PENDING, bill_key
+
+logger = logging.getLogger(__name__)
+
+
+def parse_shard(value):
+    """Parse "i/N" (0 <= i < N) into (i, N)"""
+    try:
+        index, count = (int(part) for part in value.split("/"))
+    except ValueError:
+        raise ValueError(f"Invalid shard {value!r}, expected i/N such as 0/4")
+    if count < 1 or not 0 <= index < count:
+        raise ValueError(f"Invalid shard {value!r}, expected 0 <= i < N")
+    return index, count
+
+
+def parse_store_range(value):
+    """Parse "A-B" into an inclusive (A, B) store id range; either side may be empty"""
+    low, sep, high = value.partition("-")
+    if not sep:
+        raise ValueError(f"Invalid store range {value!r}, expected A-B such as 1000-1999")
+    try:
+        return (int(low) if low else None, int(high) if high else None)
+    except ValueError:
+        raise ValueError(f"Invalid store range {value!r}, expected A-B such as 1000-1999")
+
+
+def filter_store_range(bills, store_range):
+    low, high = store_range
+    return [
+        bill for bill in bills
+        if (low is None or bill["store_id"] >= low) and (high is None or bill["store_id"] <= high)
+    ]
+
+
+def assign_shards(bills, shard_count, weights=None):
+    """Deterministic shard index per bill
+
+    没有 weights 时按 stable_hash 取模，每个账单的分片只取决于它自己的键，各节点结果一定一致。
+    有 weights（预计页数）时从大到小依次分给当前负载最小的分片，权重相同按 stable_hash 排序，
+    负载相同取编号最小的分片；这种划分依赖整批账单与订单数，只要某个节点读到的任一数字不同，
+    整个划分都可能不同，导致账单被漏掉或重复生成，只能在各节点输入完全一致时使用。
+    """
+    if weights is None:
+        return [stable_hash(bill) % shard_count for bill in bills]
+    order = sorted(range(len(bills)), key=lambda idx: (-weights[idx], stable_hash(bills[idx])))
+    loads = [0] * shard_count
+    shards = [None] * len(bills)
+    for idx in order:
+        shard = min(range(shard_count), key=lambda i: (loads[i], i))
+        shards[idx] = shard
+        loads[shard] += weights[idx]
+    return shards
+
+
+def select_shard(bills, shard_index, shard_count, weights=None):
+    """Bills that belong to one shard, keeping their original order"""
+    shards = assign_shards(bills, shard_count, weights)
+    selected = [bill for bill, shard in zip(bills, shards) if shard == shard_index]
+    if weights is not None:
+        loads = [0] * shard_count
+        for shard, weight in zip(shards, weights):
+            loads[shard] += weight
+        logger.info(f"Shard {shard_index}/{shard_count}: {len(selected)} bills, estimated pages per shard {loads}")
+    return selected
+
+
+def manifest_name(shard_index=None, shard_count=None):
+    """Manifest file name, one per shard so nodes can share a batch directory"""
+    if shard_count is None:
+        return MANIFEST_NAME
+    stem, ext = os.path.splitext(MANIFEST_NAME)
+    return f"{stem}.shard-{shard_index}-of-{shard_count}{ext}"
+
+
+def merge_manifests(batch_dirs, expected_bills=None):
+    """Combine the manifests of several batch directories, newest record per bill wins
+
+    返回 (results, elapsed)：results 与 process_bundle 的结果格式相同，只有 pending 记录的账单
+    （对应分片中断）记为失败；elapsed 为所有记录的时间跨度，即整批的墙钟时间。
+    传入 expected_bills（如 get_pending_bills()）时检查覆盖：不在任何 manifest 中的账单记为失败，
+    被多个 manifest 完成的账单记录警告。
+    """
+    stem, ext = os.path.splitext(MANIFEST_NAME)
+    entries = {}
+    done_in = {}
+    timestamps = []
+    for batch_dir in batch_dirs:
+        for path in sorted(glob.glob(os.path.join(batch_dir, f"{stem}*{ext}"))):
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    timestamps.append(entry["updated_at"])
+                    if entry["status"] == STATUS_DONE:
+                        done_in.setdefault(entry["key"], set()).add(path)
+                    current = entries.get(entry["key"])
+                    if current is None or entry["updated_at"] >= current["updated_at"]:
+                        entries[entry["key"]] = entry
+            logger.info(f"Merged {path}")
+
+    duplicated = [key for key, paths in done_in.items() if len(paths) > 1]
+    if duplicated:
+        logger.warning(f"{len(duplicated)} bills were generated by more than one shard, e.g. {duplicated[:5]}")
+
+    missing = []
+    if expected_bills is not None:
+        missing = [bill for bill in expected_bills if bill_key(bill) not in entries]
+        if missing:
+            logger.error(
+                f"{len(missing)} of {len(expected_bills)} pending bills are missing from every manifest, "
+                f"e.g. store_id {[bill['store_id'] for bill in missing[:10]]}"
+            )
+
+    results = []
+    for key in sorted(entries, key=lambda key: (entries[key]["store_id"], key)):
+        entry = entries[key]
+        error = entry.get("error")
+        if entry["status"] == STATUS_PENDING:
+            error = "Not finished (pending)"
+        elif entry["status"] != STATUS_DONE and not error:
+            error = entry["status"]
+        results.append({
+            "store_id": entry["store_id"],
+            "store_name": entry.get("store_name"),
+            "report_path": entry.get("report_path"),
+            "url": entry.get("url"),
+            "error": error,
+            "elapsed": entry.get("elapsed") or 0.0,
+        })
+    for bill in missing:
+        results.append({
+            "store_id": bill["store_id"],
+            "store_name": None,
+            "report_path": None,
+            "url": None,
+            "error": "Missing from every shard manifest",
+            "elapsed": 0.0,
+        })
+    elapsed = max(timestamps) - min(timestamps) if timestamps else 0.0
+    return results, elapsed
+
+
+def write_summary_json(path, results, elapsed):
+    """Machine-readable counterpart of summary.txt"""
+    summary = {
+        "total": len(results),
+        "generated": sum(1 for result in results if not result["error"]),
+        "failed": sum(1 for result in results if result["error"]),
+        "elapsed": round(elapsed, 3),
+        "reports": results,
+    }
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(summary, f, ensure_ascii=False, indent=2)
+    return path
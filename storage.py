@@ -0,0 +1,67 @@
+import os
+import logging
+import threading
+
+import boto3
+from dotenv import load_dotenv
+
+logger = logging.getLogger(__name__)
+
+_s3_client = None
+_s3_lock = threading.Lock()
+
+
+def _s3_settings():
+    load_dotenv()
+    return {
+        "access_key": os.environ.get("AWS_ACCESS_KEY"),
+        "secret_key": os.environ.get("AWS_SECRET_KEY"),
+        "region": os.environ.get("AWS_REGION", "us-west-2"),
+        "bucket": os.environ.get("AWS_BUCKET_NAME", "zomi-transaction-reports"),
+    }
+
+
+def get_s3_client():
+    """Process-wide S3 client; boto3 clients are thread-safe, so upload threads share one"""
+    global _s3_client
+    if _s3_client is None:
+        with _s3_lock:
+            if _s3_client is None:
+                settings = _s3_settings()
+                _s3_client = boto3.client(
+                    's3',
+                    aws_access_key_id=settings["access_key"],
+                    aws_secret_access_key=settings["secret_key"],
+                    region_name=settings["region"]
+                )
+    return _s3_client
+
+
+def upload_to_s3(file_path, file_name=None, content_type="application/pdf"):
+    """
+    将文件上传到 S3 并返回可访问的 URL
+    """
+    if not file_name:
+        file_name = os.path.basename(file_path)
+    settings = _s3_settings()
+
+    try:
+        # 上传文件到 S3
+        get_s3_client().upload_file(
+            file_path,
+            settings["bucket"],
+            file_name,
+            ExtraArgs={
+                'ContentType': content_type,
+                'ACL': 'public-read'  # 设置为公开可读
+            }
+        )
+
+        # 构建并返回 URL
+        url = f"https://{settings['bucket']}.s3.{settings['region']}.amazonaws.com/{file_name}"
+        logger.info(f"File uploaded to S3: {url}")
+        return url
+
+    except Exception as e:
+        logger.error(f"Error uploading to S3: {str(e)}")
+        raise
@@ -1,74 +1,218 @@
-from decimal import Decimal
-import mysql.connector
 import os
-from dotenv import load_dotenv
+import queue
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+from db_pool import get_pool
+from tax_rates import get_tax_rate_registry
 
 class TaxCalculator:
-    BC_GST_RATE = Decimal("0.05")
-    BC_SodaTax_RATE = Decimal("0.07")
-    BC_LiquorTax_RATE = Decimal("0.10")
+    # 税率由 tax_rates.json 按 system_tax_id 与生效日期配置，见 TaxRateRegistry
 
     def __init__(self):
-        load_dotenv()
-        self.connection = mysql.connector.connect(
-            host=os.getenv('MYSQL_HOST'),
-            user=os.getenv('MYSQL_USER'),
-            password=os.getenv('MYSQL_PASS'),
-            database=os.getenv('MYSQL_DB')
-        )
+        self.pool = get_pool()
+        self.tax_rates = get_tax_rate_registry()
+        self.connection = self.pool.acquire()
         self.cursor = self.connection.cursor(dictionary=True)
+        # get_pool() 已加载 .env，可在此读取分块配置
+        self.chunk_size = int(os.getenv("TAX_CHUNK_SIZE", self.IN_CHUNK_SIZE))
+        self.chunk_workers = int(os.getenv("TAX_CHUNK_WORKERS", self.CHUNK_WORKERS))
+
+    # 每条 IN (...) 语句最多包含的订单数，避免超过 max_allowed_packet
+    IN_CHUNK_SIZE = 1000
+    # 大订单量时并发执行分块查询的连接数（含自身连接），额外连接只借用连接池当前空闲的
+    CHUNK_WORKERS = 1
+
+    TAX_ROWS_QUERY = """
+        SELECT odt.order_id, odt.dish_id, odt.system_tax_id, od.amount
+        FROM order_dish_tax odt
+        JOIN order_dish od ON odt.order_id = od.order_id AND odt.dish_id = od.dish_id
+        WHERE odt.order_id IN ({format_strings})
+    """
+
+    # 在数据库中按税种汇总金额，只有三四行结果返回
+    TAX_SUMS_QUERY = """
+        SELECT odt.system_tax_id, SUM(od.amount) AS amount
+        FROM order_dish_tax odt
+        JOIN order_dish od ON odt.order_id = od.order_id AND odt.dish_id = od.dish_id
+        WHERE odt.order_id IN ({format_strings})
+        GROUP BY odt.system_tax_id
+    """
+
+    # 多个 (store_id, start_date, end_date) 周期一次扫描，按周期与税种分组
+    BILL_TAX_SUMS_QUERY = """
+        SELECT w.idx, odt.system_tax_id, SUM(od.amount) AS amount
+        FROM ({windows}) w
+        JOIN `order` o ON o.store_id = w.store_id
+          AND o.complete_time >= w.start_date
+          AND o.complete_time < DATE_ADD(w.end_date, INTERVAL 1 DAY)
+          AND o.state = 5000
+          AND o.payment_method != 4
+        JOIN order_dish_tax odt ON odt.order_id = o.id
+        JOIN order_dish od ON odt.order_id = od.order_id AND odt.dish_id = od.dish_id
+        GROUP BY w.idx, odt.system_tax_id
+    """
+    # 单条语句最多包含的账单周期数
+    BILL_CHUNK_SIZE = 1000
+
+    def calculate_taxes(self, order_ids, chunk_size=None, workers=None, as_of=None):
+        """根据订单ID列表计算GST_total与PST_total，金额在数据库中按 system_tax_id 汇总
 
-    def calculate_taxes(self, order_ids):
-        """根据订单ID列表计算GST_total与PST_total"""
+        订单ID按 chunk_size 分块查询，workers > 1 时分块在自身连接与连接池当前空闲的连接上并发执行，
+        各块的部分和以Decimal精确合并后再应用 as_of 当天生效的税率（通常为账单 start_date）。
+        额外连接以非阻塞方式借用，借不到就少开线程，没有空闲连接时在自身连接上顺序执行：
+        已持有连接再等待连接池，会在并发请求时互相等待直到 PoolTimeoutError
+        """
+        if not order_ids:
+            return {"GST_total": Decimal("0.00"), "PST_total": Decimal("0.00")}
+        chunks = self._chunk_ids(order_ids, chunk_size or self.chunk_size)
+        workers = min(workers or self.chunk_workers, len(chunks))
+
+        extra = []
+        while len(extra) < workers - 1:
+            connection = self.pool.acquire(block=False)
+            if connection is None:
+                break
+            extra.append(connection)
+
+        sums = {}
+        try:
+            if not extra:
+                for chunk in chunks:
+                    self._merge_sums(sums, self._fetch_tax_sums(self.cursor, chunk))
+            else:
+                pending = queue.Queue()
+                for chunk in chunks:
+                    pending.put(chunk)
+                connections = [self.connection] + extra
+                with ThreadPoolExecutor(max_workers=len(connections)) as executor:
+                    partials = executor.map(lambda connection: self._drain_chunks(connection, pending), connections)
+                    for partial in partials:
+                        self._merge_sums(sums, partial)
+        finally:
+            for connection in extra:
+                self.pool.release(connection)
+        return self.tax_rates.apply(sums, as_of)
+
+    def _fetch_tax_sums(self, cursor, chunk):
+        format_strings = ','.join(['%s'] * len(chunk))
+        query = self.TAX_SUMS_QUERY.format(format_strings=format_strings)
+        cursor.execute(query, tuple(chunk))
+        return {
+            row["system_tax_id"]: Decimal(str(row["amount"] or 0))
+            for row in cursor.fetchall()
+        }
+
+    def _drain_chunks(self, connection, pending):
+        """Query chunks from `pending` on one connection until it is empty, returns the summed partials"""
+        sums = {}
+        cursor = connection.cursor(dictionary=True)
+        try:
+            while True:
+                try:
+                    chunk = pending.get_nowait()
+                except queue.Empty:
+                    return sums
+                self._merge_sums(sums, self._fetch_tax_sums(cursor, chunk))
+        finally:
+            cursor.close()
+
+    @staticmethod
+    def _chunk_ids(order_ids, chunk_size):
+        order_ids = list(dict.fromkeys(order_ids))
+        chunks = [order_ids[i:i + chunk_size] for i in range(0, len(order_ids), chunk_size)]
+        # 最后一块用重复ID补齐长度，使每条语句形状相同，便于复用语句缓存（IN 列表重复不影响结果）
+        if len(chunks) > 1 and len(chunks[-1]) < chunk_size:
+            last = chunks[-1]
+            last.extend([last[-1]] * (chunk_size - len(last)))
+        return chunks
+
+    @staticmethod
+    def _merge_sums(target, partial):
+        for system_tax_id, amount in partial.items():
+            target[system_tax_id] = target.get(system_tax_id, Decimal("0")) + amount
+
+    def calculate_taxes_rowwise(self, order_ids, as_of=None):
+        """逐行读取并在Python中累加的旧算法，仅用于核对 calculate_taxes 的结果"""
         if not order_ids:
             return {"GST_total": Decimal("0.00"), "PST_total": Decimal("0.00")}
         format_strings = ','.join(['%s'] * len(order_ids))
-        query = f"""
-            SELECT odt.order_id, odt.dish_id, odt.system_tax_id, od.amount
-            FROM order_dish_tax odt
-            JOIN order_dish od ON odt.order_id = od.order_id AND odt.dish_id = od.dish_id
-            WHERE odt.order_id IN ({format_strings})
-        """
+        query = self.TAX_ROWS_QUERY.format(format_strings=format_strings)
         self.cursor.execute(query, tuple(order_ids))
         rows = self.cursor.fetchall()
+        return self._totals_from_rows(rows, as_of)
+
+    def calculate_taxes_for_bills(self, bills):
+        """批量计算多个账单周期的税额，返回 {(store_id, start_date, end_date): {"GST_total", "PST_total"}}
+
+        订单筛选条件与 iter_orders_by_store_and_period 相同，order 与 order_dish_tax/order_dish
+        在数据库中关联并按周期、税种分组，整批账单只需一次扫描；每个周期使用其 start_date 生效的税率
+        """
+        windows = list(dict.fromkeys(
+            (bill["store_id"], bill["start_date"], bill["end_date"]) for bill in bills
+        ))
+        sums_by_window = {window: {} for window in windows}
+        for i in range(0, len(windows), self.BILL_CHUNK_SIZE):
+            chunk = windows[i:i + self.BILL_CHUNK_SIZE]
+            derived = " UNION ALL ".join(
+                ["SELECT %s AS idx, %s AS store_id, %s AS start_date, %s AS end_date"]
+                + ["SELECT %s, %s, %s, %s"] * (len(chunk) - 1)
+            )
+            params = []
+            for idx, (store_id, start_date, end_date) in enumerate(chunk):
+                params.extend((idx, store_id, start_date, end_date))
+            self.cursor.execute(self.BILL_TAX_SUMS_QUERY.format(windows=derived), tuple(params))
+            for row in self.cursor.fetchall():
+                self._merge_sums(
+                    sums_by_window[chunk[row["idx"]]],
+                    {row["system_tax_id"]: Decimal(str(row["amount"] or 0))},
+                )
+
+        return {
+            window: self.tax_rates.apply(sums, as_of=window[1])
+            for window, sums in sums_by_window.items()
+        }
+
+    def _totals_from_rows(self, rows, as_of=None):
+        rates = self.tax_rates.rates_for(as_of)
+        totals = {"GST": Decimal("0.00"), "PST": Decimal("0.00")}
 
-        GST_total = Decimal("0.00")
-        PST_total = Decimal("0.00")
-        
         for row in rows:
             # 确保使用Decimal转换数据库中的数值
             amount = Decimal(str(row["amount"]))
-            system_tax_id = row["system_tax_id"]
-            
-            if system_tax_id == 1:
-                # GST计算
-                GST_total += amount * self.BC_GST_RATE
-            elif system_tax_id == 2:
-                # 酒类税计算
-                PST_total += amount * self.BC_LiquorTax_RATE
-            elif system_tax_id == 3:
-                # 碳酸饮料税计算
-                PST_total += amount * self.BC_SodaTax_RATE
+            if row["system_tax_id"] in rates:
+                bucket, rate = rates[row["system_tax_id"]]
+                totals[bucket] += amount * rate
 
         # 使用quantize确保一致的小数位数
-        GST_total = GST_total.quantize(Decimal('0.01'))
-        PST_total = PST_total.quantize(Decimal('0.01'))
+        GST_total = totals["GST"].quantize(Decimal('0.01'))
+        PST_total = totals["PST"].quantize(Decimal('0.01'))
 
         return {"GST_total": GST_total, "PST_total": PST_total}
 
     def close(self):
-        self.cursor.close()
-        self.connection.close()
+        if self.connection is None:
+            return
+        try:
+            self.cursor.close()
+        finally:
+            self.pool.release(self.connection)
+            self.connection = None
 
 
 if __name__ == "__main__":
     # 可通过命令行传入订单ID列表以测试
+    # python tax_cal.py --compare <order_id> ... 同时运行逐行算法并核对结果
     import sys
-    order_ids = sys.argv[1:]
+    args = sys.argv[1:]
+    compare = "--compare" in args
+    order_ids = [arg for arg in args if arg != "--compare"]
     tc = TaxCalculator()
     totals = tc.calculate_taxes(order_ids)
     print("GST_total:", totals["GST_total"])
     print("PST_total:", totals["PST_total"])
+    if compare:
+        rowwise = tc.calculate_taxes_rowwise(order_ids)
+        print("row-wise GST_total:", rowwise["GST_total"])
+        print("row-wise PST_total:", rowwise["PST_total"])
+        print("MATCH" if rowwise == totals else "MISMATCH")
     tc.close()
-
-
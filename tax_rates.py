@@ -0,0 +1,146 @@
+import os
+import json
+import time
+import datetime
+import threading
+from decimal import Decimal
+from functools import lru_cache
+
+
+class TaxRateRegistry:
+    """Tax rates keyed by system_tax_id with effective date ranges, loaded from tax_rates.json
+
+    每条税率: system_tax_id, bucket (GST/PST), rate, effective_from/effective_to（包含当天，null 表示不限）。
+    文件只在进程内加载一次，按日期解析出的税率表会被缓存；文件修改后最多 check_interval 秒内自动失效，
+    也可以调用 invalidate() 立即失效。
+    """
+
+    BUCKETS = ("GST", "PST")
+
+    def __init__(self, path, check_interval=60):
+        self.path = path
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._entries = None
+        self._mtime = None
+        self._checked_at = 0.0
+
+    def _load(self):
+        with open(self.path, "r") as f:
+            config = json.load(f)
+        entries = []
+        for item in config["rates"]:
+            bucket = item["bucket"]
+            if bucket not in self.BUCKETS:
+                raise ValueError(f"Unknown tax bucket {bucket!r} for system_tax_id {item['system_tax_id']}")
+            entries.append({
+                "system_tax_id": item["system_tax_id"],
+                "bucket": bucket,
+                "rate": Decimal(str(item["rate"])),
+                "effective_from": _parse_date(item.get("effective_from")),
+                "effective_to": _parse_date(item.get("effective_to")),
+            })
+
+        # 同一税种的生效区间不能重叠，否则历史周报的税率不确定
+        by_id = {}
+        for entry in entries:
+            by_id.setdefault(entry["system_tax_id"], []).append(entry)
+        for system_tax_id, items in by_id.items():
+            items.sort(key=lambda e: e["effective_from"] or datetime.date.min)
+            for prev, cur in zip(items, items[1:]):
+                prev_to = prev["effective_to"] or datetime.date.max
+                cur_from = cur["effective_from"] or datetime.date.min
+                if cur_from <= prev_to:
+                    raise ValueError(f"Overlapping tax rate ranges for system_tax_id {system_tax_id}")
+        # 不可变的元组，可直接作为 _rate_table 的缓存键，并发读取时不会被修改
+        return tuple(
+            (e["system_tax_id"], e["bucket"], e["rate"], e["effective_from"], e["effective_to"])
+            for e in entries
+        )
+
+    def _ensure_loaded(self):
+        """Return the current entries, reloading the file when it changed"""
+        now = time.monotonic()
+        entries = self._entries
+        if entries is not None and now - self._checked_at < self.check_interval:
+            return entries
+        with self._lock:
+            mtime = os.path.getmtime(self.path)
+            if self._entries is None or mtime != self._mtime:
+                self._entries = self._load()
+                self._mtime = mtime
+            self._checked_at = now
+            return self._entries
+
+    def invalidate(self):
+        """Force a reload on next lookup"""
+        # 只清除检查时间与 mtime，_entries 保留给正在查询的线程，下一次查询时整体替换
+        with self._lock:
+            self._mtime = None
+            self._checked_at = 0.0
+
+    def rates_for(self, as_of=None):
+        """Return {system_tax_id: (bucket, rate)} in force on `as_of` (default today)"""
+        entries = self._ensure_loaded()
+        as_of = _to_date(as_of) if as_of is not None else datetime.date.today()
+        return _rate_table(entries, as_of)
+
+    def apply(self, sums, as_of=None):
+        """Apply rates to {system_tax_id: amount} sums, returns quantized GST_total/PST_total"""
+        table = self.rates_for(as_of)
+        totals = {bucket: Decimal("0") for bucket in self.BUCKETS}
+        for system_tax_id, amount in sums.items():
+            # 未登记的税种不计税，与原 if/elif 逻辑一致
+            if system_tax_id in table:
+                bucket, rate = table[system_tax_id]
+                totals[bucket] += amount * rate
+        # 使用quantize确保一致的小数位数
+        return {
+            "GST_total": totals["GST"].quantize(Decimal("0.01")),
+            "PST_total": totals["PST"].quantize(Decimal("0.01")),
+        }
+
+
+@lru_cache(maxsize=256)
+def _rate_table(entries, as_of):
+    # entries 本身参与缓存键，文件重新加载后旧的解析结果自然失效
+    table = {}
+    for system_tax_id, bucket, rate, effective_from, effective_to in entries:
+        if effective_from and as_of < effective_from:
+            continue
+        if effective_to and as_of > effective_to:
+            continue
+        table[system_tax_id] = (bucket, rate)
+    return table
+
+
+def _parse_date(value):
+    if not value:
+        return None
+    return datetime.datetime.strptime(value, "%Y-%m-%d").date()
+
+
+def _to_date(value):
+    if isinstance(value, datetime.datetime):
+        return value.date()
+    if isinstance(value, datetime.date):
+        return value
+    return _parse_date(str(value))
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_tax_rate_registry():
+    """Process-wide registry backed by tax_rates.json next to this module"""
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                path = os.getenv(
+                    "TAX_RATES_PATH",
+                    os.path.join(os.path.dirname(os.path.abspath(__file__)), "tax_rates.json"),
+                )
+                _registry = TaxRateRegistry(path)
+    return _registry
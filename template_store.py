@@ -0,0 +1,102 @@
+import os
+import mmap
+import logging
+import tempfile
+from PIL import Image
+
+from pdf_writer import default_file_mode, flatten_to_rgb
+
+logger = logging.getLogger(__name__)
+
+
+def default_cache_dir():
+    """Per-user cache directory ($XDG_CACHE_HOME or ~/.cache, else the temp dir), outside the source tree"""
+    base = os.getenv("XDG_CACHE_HOME")
+    if not base:
+        home = os.path.expanduser("~")
+        # 没有 HOME 时 expanduser 原样返回 "~"
+        base = os.path.join(home, ".cache") if home != "~" else tempfile.gettempdir()
+    return os.path.join(base, "biz-transaction-report", "templates")
+
+
+class FlattenedTemplateStore:
+    """Page templates flattened once to raw pixel files and memory-mapped read-only
+
+    模板 PNG 只在源文件变化时解码并去掉透明通道，结果以原始像素写入缓存目录，
+    文件名包含源文件的 mtime 与大小；之后各进程通过 mmap 只读映射同一份文件，
+    预先 fork 的 worker 共享同一份物理内存，不再重复解码 PNG 和做 alpha 合成。
+    像素按 RGBX（每像素 4 字节，与 PIL 内部 RGB 布局相同）存储，PIL 才能直接映射而不复制。
+    缓存目录默认为 default_cache_dir()，可通过 REPORT_TEMPLATE_CACHE 修改；目录不可写时退回到
+    进程内解码（每个进程各持有一份像素），报告照常生成。
+    """
+
+    MODE = "RGBX"
+
+    def __init__(self, cache_dir=None):
+        self.cache_dir = cache_dir or os.getenv("REPORT_TEMPLATE_CACHE") or default_cache_dir()
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+        except OSError as e:
+            logger.warning(f"Template cache {self.cache_dir} unavailable ({e}), flattening templates in memory")
+            self.cache_dir = None
+        self._maps = {}
+
+    def _cache_path(self, key, source_path, size):
+        stat = os.stat(source_path)
+        width, height = size
+        return os.path.join(
+            self.cache_dir,
+            f"{key}-{stat.st_mtime_ns}-{stat.st_size}-{width}x{height}.{self.MODE.lower()}",
+        )
+
+    def _flatten(self, source_path):
+        with Image.open(source_path) as img:
+            img.load()
+            return flatten_to_rgb(img)
+
+    def _build(self, key, source_path, cache_path):
+        """Decode and flatten the source PNG, write the raw pixels atomically"""
+        flat = self._flatten(source_path)
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, prefix=f".{key}.", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(flat.tobytes("raw", self.MODE))
+            os.chmod(tmp_path, default_file_mode())
+            os.replace(tmp_path, cache_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        # 删除同一模板的旧缓存文件
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            if name.startswith(f"{key}-") and path != cache_path:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    # 另一个进程同时在重建并已删除
+                    pass
+        logger.info(f"Flattened template {source_path} -> {cache_path}")
+
+    def load(self, key, source_path):
+        """Return a read-only RGBX image backed by the memory-mapped cache file, or an in-memory RGB image"""
+        if self.cache_dir is None:
+            return self._flatten(source_path)
+        # Image.open 只读取文件头获取尺寸，不解码像素
+        with Image.open(source_path) as src:
+            size = src.size
+        cache_path = self._cache_path(key, source_path, size)
+        expected = size[0] * size[1] * len(self.MODE)
+        if not os.path.exists(cache_path) or os.path.getsize(cache_path) != expected:
+            try:
+                self._build(key, source_path, cache_path)
+            except OSError as e:
+                # 目录存在但不可写（只读挂载、权限不足、磁盘已满）
+                logger.warning(f"Cannot write template cache {cache_path} ({e}), flattening {key} in memory")
+                return self._flatten(source_path)
+
+        with open(cache_path, "rb") as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._maps[key] = mapped
+        # frombuffer 直接引用映射内存，不复制；得到的图像只读，页面需 copy() 后绘制
+        return Image.frombuffer(self.MODE, size, mapped, "raw", self.MODE, 0, 1)
@@ -0,0 +1,177 @@
+import os
+import sys
+import json
+import datetime
+import threading
+from decimal import Decimal
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import tax_cal
+from db_pool import ConnectionPool
+from tax_cal import TaxCalculator
+from tax_rates import TaxRateRegistry
+
+# 仓库中的 tax_rates.json，期望值按原来写死的税率计算：
+# BC_GST_RATE 0.05 (system_tax_id 1)，BC_LiquorTax_RATE 0.10 (2)，BC_SodaTax_RATE 0.07 (3)
+TAX_RATES_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "tax_rates.json")
+
+# (order_id, system_tax_id, amount)：order_dish_tax 与 order_dish 关联后的行
+DISH_TAXES = [(order_id, 1 + order_id % 3, Decimal(f"{order_id}.25")) for order_id in range(1, 41)]
+
+
+class FakeCursor:
+    """按 TAX_SUMS_QUERY 的语义返回分组结果：IN 列表中的重复ID不影响结果"""
+
+    def __init__(self, connection):
+        self.connection = connection
+        self._rows = []
+
+    def execute(self, query, params):
+        assert "GROUP BY odt.system_tax_id" in query
+        self.connection.queries.append((threading.current_thread().name, len(params)))
+        order_ids = set(params)
+        sums = {}
+        for order_id, system_tax_id, amount in self.connection.dish_taxes:
+            if order_id in order_ids:
+                sums[system_tax_id] = sums.get(system_tax_id, Decimal("0")) + Decimal(amount)
+        self._rows = [{"system_tax_id": key, "amount": amount} for key, amount in sums.items()]
+
+    def fetchall(self):
+        rows, self._rows = self._rows, []
+        return rows
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    unread_result = False
+
+    def __init__(self, dish_taxes):
+        self.dish_taxes = dish_taxes
+        self.queries = []
+
+    def cursor(self, dictionary=False):
+        return FakeCursor(self)
+
+    def is_connected(self):
+        return True
+
+    def close(self):
+        pass
+
+
+def make_pool(size, dish_taxes=DISH_TAXES):
+    # 真实的 ConnectionPool，只把建立连接换成 FakeConnection；等待超时很短，互相等待会直接失败
+    pool = ConnectionPool(size=size, timeout=0.2, pre_ping=False)
+    pool._connect = lambda: FakeConnection(dish_taxes)
+    return pool
+
+
+@pytest.fixture
+def make_calculator(monkeypatch):
+    def build(pool, rates_path=TAX_RATES_PATH):
+        registry = TaxRateRegistry(rates_path)
+        monkeypatch.setattr(tax_cal, "get_pool", lambda: pool)
+        monkeypatch.setattr(tax_cal, "get_tax_rate_registry", lambda: registry)
+        return TaxCalculator()
+    return build
+
+
+CASES = [
+    # GST 0.10 * 0.05 = 0.005，PST 0.50 * 0.07 = 0.035：半分按 ROUND_HALF_EVEN
+    ([(1, 1, "0.10"), (2, 3, "0.50")], [1, 2], "0.00", "0.04"),
+    # GST 0.30 * 0.05 = 0.015，PST 0.25 * 0.10 = 0.025
+    ([(1, 1, "0.30"), (2, 2, "0.25")], [1, 2], "0.02", "0.02"),
+    # 各行单独不足半分，合计后才进位
+    (
+        [(1, 1, "0.04"), (2, 1, "0.04"), (3, 1, "0.04"), (4, 2, "0.01"), (5, 2, "0.04")],
+        [1, 2, 3, 4, 5],
+        "0.01",
+        "0.00",
+    ),
+    # 11 个订单分成多块，最后一块用重复ID补齐；重复传入的ID和未请求的订单不计入
+    (
+        [(o, 1, "1.11") for o in range(1, 12)] + [(o, 3, "2.50") for o in range(1, 12)] + [(50, 1, "1000.00")],
+        list(range(1, 12)) + [1, 2],
+        "0.61",
+        "1.92",
+    ),
+    # 负数金额；未登记的税种不计税
+    (
+        [(1, 1, "19.99"), (1, 1, "-4.99"), (2, 2, "-0.25"), (3, 3, "3.00"), (4, 99, "100.00")],
+        [1, 2, 3, 4],
+        "0.75",
+        "0.18",
+    ),
+]
+
+
+@pytest.mark.parametrize("dish_taxes, order_ids, gst_total, pst_total", CASES)
+@pytest.mark.parametrize("workers", [1, 3])
+def test_calculate_taxes_matches_original_rates(make_calculator, dish_taxes, order_ids, gst_total, pst_total, workers):
+    pool = make_pool(3, dish_taxes)
+    calc = make_calculator(pool)
+    totals = calc.calculate_taxes(order_ids, chunk_size=2, workers=workers, as_of=datetime.date(2024, 1, 1))
+    calc.close()
+
+    assert totals == {"GST_total": Decimal(gst_total), "PST_total": Decimal(pst_total)}
+    for value in totals.values():
+        assert value.as_tuple().exponent == -2
+
+
+def test_chunks_are_padded_to_the_same_shape():
+    assert TaxCalculator._chunk_ids([1, 2, 3, 2, 4, 5], 2) == [[1, 2], [3, 4], [5, 5]]
+    assert TaxCalculator._chunk_ids([1, 2, 3], 5) == [[1, 2, 3]]
+
+
+def test_rates_follow_effective_dates(make_calculator, tmp_path):
+    path = tmp_path / "tax_rates.json"
+    path.write_text(json.dumps({
+        "rates": [
+            {"system_tax_id": 1, "bucket": "GST", "rate": "0.05", "effective_from": None, "effective_to": None},
+            {"system_tax_id": 3, "bucket": "PST", "rate": "0.07", "effective_from": None, "effective_to": "2024-06-30"},
+            {"system_tax_id": 3, "bucket": "PST", "rate": "0.08", "effective_from": "2024-07-01", "effective_to": None},
+        ]
+    }))
+    calc = make_calculator(make_pool(1, [(1, 1, "10.00"), (1, 3, "10.00")]), str(path))
+    assert calc.calculate_taxes([1], as_of=datetime.date(2024, 6, 30))["PST_total"] == Decimal("0.70")
+    assert calc.calculate_taxes([1], as_of=datetime.date(2024, 7, 1))["PST_total"] == Decimal("0.80")
+    calc.close()
+
+
+def test_parallel_chunks_do_not_wait_for_a_full_pool(make_calculator):
+    pool = make_pool(3)
+    # Flask 请求中 DatabaseConnector 已占用一个连接，另一个并发请求占用一个，TaxCalculator 占用最后一个
+    request_connection = pool.acquire()
+    other_request_connection = pool.acquire()
+    calc = make_calculator(pool)
+    order_ids = list(range(1, 41))
+    totals = calc.calculate_taxes(order_ids, chunk_size=7, workers=4, as_of=datetime.date(2024, 1, 1))
+
+    # 没有空闲连接：全部 6 块在自身连接上顺序执行，不等待连接池
+    assert len(calc.connection.queries) == 6
+    assert totals == calc.calculate_taxes(order_ids, chunk_size=40, as_of=datetime.date(2024, 1, 1))
+    stats = pool.stats()
+    assert stats["waits"] == 0 and stats["timeouts"] == 0
+    assert stats["in_use"] == 3
+    calc.close()
+    pool.release(request_connection)
+    pool.release(other_request_connection)
+
+
+def test_parallel_chunks_use_only_free_connections(make_calculator):
+    pool = make_pool(3)
+    calc = make_calculator(pool)
+    order_ids = list(range(1, 41))
+    totals = calc.calculate_taxes(order_ids, chunk_size=5, workers=8, as_of=datetime.date(2024, 1, 1))
+
+    assert totals == calc.calculate_taxes(order_ids, chunk_size=40, as_of=datetime.date(2024, 1, 1))
+    stats = pool.stats()
+    # 自身连接加两个空闲连接，用完后归还
+    assert stats["open"] == 3 and stats["in_use"] == 1
+    assert stats["waits"] == 0 and stats["timeouts"] == 0
+    calc.close()
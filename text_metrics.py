@@ -0,0 +1,71 @@
+from functools import lru_cache
+
+# 缓存上限：整段文字（商户名称、地址、时间段等）与单个字形/单词的宽度
+TEXT_CACHE_SIZE = 4096
+GLYPH_CACHE_SIZE = 2048
+# 字形宽度累加与实际排版宽度的误差上限（相对字号），超出该区间才做一次精确测量
+ESTIMATE_TOLERANCE = 0.25
+
+
+@lru_cache(maxsize=TEXT_CACHE_SIZE)
+def text_width(font, text):
+    """Rendered pixel width of text, same value as ImageDraw.textsize(text, font)[0]"""
+    left, _, right, _ = font.getbbox(text)
+    return right - left
+
+
+@lru_cache(maxsize=GLYPH_CACHE_SIZE)
+def glyph_advance(font, char):
+    """Horizontal advance of a single character"""
+    return font.getlength(char)
+
+
+@lru_cache(maxsize=TEXT_CACHE_SIZE)
+def word_advance(font, word):
+    """Sum of glyph advances, an additive estimate of the word's width"""
+    return sum(glyph_advance(font, char) for char in word)
+
+
+def wrap_lines(text, font, max_width):
+    """根据最大像素宽度按单词换行，结果与逐次 textsize 测量一致
+
+    行宽由单词宽度累加估算，只有估算值落在 max_width 附近的误差区间内时才精确测量整行，
+    避免对不断变长的前缀反复测量。
+    """
+    tolerance = font.size * ESTIMATE_TOLERANCE
+    space = glyph_advance(font, " ")
+    lines = []
+    current_line = ""
+    current_width = 0.0
+    for word in text.split():
+        width = word_advance(font, word)
+        if current_line:
+            test_line = f"{current_line} {word}"
+            estimate = current_width + space + width
+        else:
+            test_line = word
+            estimate = width
+
+        if estimate + tolerance <= max_width:
+            fits = True
+        elif estimate - tolerance > max_width:
+            fits = False
+        else:
+            fits = text_width(font, test_line) <= max_width
+
+        if fits:
+            current_line = test_line
+            current_width = estimate
+        else:
+            if current_line:
+                lines.append(current_line)
+            current_line = word
+            current_width = width
+    if current_line:
+        lines.append(current_line)
+    return lines
+
+
+def right_aligned_x(font, text, page_width, right_margin):
+    """x coordinate that puts text's right edge right_margin pixels from the page edge"""
+    return page_width - text_width(font, text) - right_margin
@@ -0,0 +1,246 @@
+import os
+import itertools
+import threading
+from reportlab.lib.utils import ImageReader
+from reportlab.pdfgen import canvas
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+
+from report_assets import FONT_DIR, FONT_SPECS
+from output_profiles import apply_profile, get_profile
+from pdf_writer import atomic_output, flatten_to_rgb
+from report_generator import (
+    ORDERS_PER_PAGE,
+    PageCountMismatchError,
+    additional_rows,
+    detail_row_texts,
+    overview_fields,
+    time_period_text,
+    wrap_words,
+)
+
+_fonts_registered = False
+_register_lock = threading.Lock()
+
+
+def _register_fonts():
+    """把 DM Sans / Roboto Mono 注册到 reportlab，注册名为文件名去掉扩展名"""
+    global _fonts_registered
+    with _register_lock:
+        if _fonts_registered:
+            return
+        filenames = {filename for specs in FONT_SPECS.values() for filename, _ in specs.values()}
+        for filename in sorted(filenames):
+            pdfmetrics.registerFont(
+                TTFont(os.path.splitext(filename)[0], os.path.join(FONT_DIR, filename))
+            )
+        _fonts_registered = True
+
+
+class VectorReportRenderer:
+    """Render report pages as vector text over the template PNGs, each embedded once as a shared form XObject
+
+    页面尺寸与位图后端一致（模板像素按 72 dpi 即 1px = 1pt），坐标沿用 pos_config.json，
+    PIL 的左上角坐标在绘制时转换为 PDF 的基线坐标。
+    """
+
+    def __init__(self, assets):
+        _register_fonts()
+        self.assets = assets
+        self.pos_config = assets.pos_config
+        self.page_width, self.page_height = assets.templates["overview"].size
+
+    def render(
+        self, output_path, bill_data, store_info, orders, overall_total, has_additional, profile=None
+    ):
+        """Write the whole report to output_path; orders are filtered OrderRecords, may be an iterator
+
+        文字始终为矢量，输出配置只作用于嵌入的模板图片
+        """
+        profile = get_profile(profile)
+        with atomic_output(output_path) as tmp_path:
+            self._render(
+                tmp_path, bill_data, store_info, orders, overall_total, has_additional, profile
+            )
+        return output_path
+
+    def _render(
+        self, output_path, bill_data, store_info, orders, overall_total, has_additional, profile
+    ):
+        c = canvas.Canvas(
+            output_path, pagesize=(self.page_width, self.page_height), pageCompression=1
+        )
+        c.setTitle(f"{store_info['name']} {time_period_text(bill_data)}")
+
+        # 模板图片只嵌入一次，每页通过 doForm 引用
+        template_keys = ["overview"]
+        if has_additional:
+            template_keys.append("additional")
+        for key in template_keys:
+            self._define_template_form(c, key, profile)
+
+        self._draw_overview_page(c, bill_data, store_info)
+        self._draw_page_number(c, 1, overall_total)
+        c.showPage()
+
+        page_number = 2
+        orders = iter(orders)
+        while True:
+            page_orders = list(itertools.islice(orders, ORDERS_PER_PAGE))
+            if not page_orders:
+                break
+            if page_number == 2:
+                # 是否有详情页以实际流出的订单为准（order_count 可能早于订单流读取），第一页时才定义详情模板
+                self._define_template_form(c, "detail", profile)
+                self._define_detail_background(c, bill_data, store_info)
+            self._draw_detail_page(c, bill_data, store_info, page_orders)
+            self._draw_page_number(c, page_number, overall_total)
+            c.showPage()
+            page_number += 1
+
+        if has_additional:
+            self._draw_additional_page(c, bill_data, store_info)
+            self._draw_page_number(c, page_number, overall_total)
+            c.showPage()
+            page_number += 1
+
+        if page_number - 1 != overall_total:
+            # 在 atomic_output 内抛出，临时文件被删除，见 ReportGenerator.generate_report
+            raise PageCountMismatchError(
+                f"expected {overall_total} pages from order_count, rendered {page_number - 1}"
+            )
+        c.save()
+
+    def _form_name(self, template_key):
+        return f"template_{template_key}"
+
+    def _template_image(self, template_key, profile):
+        """archival 直接嵌入模板 PNG，其余配置先按配置缩放、转换颜色模式"""
+        if profile.scale == 1.0 and profile.mode == "RGB":
+            return self.assets.template_paths[template_key]
+        img = apply_profile(flatten_to_rgb(self.assets.templates[template_key]), profile)
+        if img.mode == "P":
+            # reportlab 不直接写入调色板图像，量化后的颜色转回 RGB 由 Flate 压缩
+            img = img.convert("RGB")
+        return ImageReader(img)
+
+    def _define_template_form(self, c, template_key, profile):
+        c.beginForm(self._form_name(template_key))
+        c.drawImage(
+            self._template_image(template_key, profile),
+            0,
+            0,
+            width=self.page_width,
+            height=self.page_height,
+            mask="auto",
+        )
+        c.endForm()
+
+    def _define_detail_background(self, c, bill_data, store_info):
+        """详情页底图（模板 + 右对齐的商户名称与时间段）每份报告只生成一次"""
+        c.beginForm("detail_background")
+        c.doForm(self._form_name("detail"))
+        pos_config = self.pos_config["detail"]
+        # 右侧保留100像素边距
+        self._draw_right_aligned(
+            c, pos_config["store_name"]["y"], store_info["name"], 100, "regular", "small"
+        )
+        self._draw_right_aligned(
+            c, pos_config["time_period"]["y"], time_period_text(bill_data), 100, "regular", "small"
+        )
+        c.endForm()
+
+    def _font(self, group, name):
+        filename, size = FONT_SPECS[group][name]
+        return os.path.splitext(filename)[0], size, self.assets.fonts[group][name]
+
+    def _draw_text(self, c, x, y, text, group, name):
+        """(x, y) 为 PIL 坐标：左上角、ascender 对齐"""
+        font_name, size, pil_font = self._font(group, name)
+        ascent, _ = pil_font.getmetrics()
+        c.setFont(font_name, size)
+        c.drawString(x, self.page_height - y - ascent, text)
+
+    def _draw_multiline(self, c, x, y, lines, group, name, spacing=4):
+        _, _, pil_font = self._font(group, name)
+        # 与 PIL multiline_text 的行距一致
+        line_height = pil_font.getbbox("A")[3] + spacing
+        for i, line in enumerate(lines):
+            self._draw_text(c, x, y + i * line_height, line, group, name)
+
+    def _text_width(self, text, group, name):
+        font_name, size, _ = self._font(group, name)
+        return pdfmetrics.stringWidth(text, font_name, size)
+
+    def _draw_right_aligned(self, c, y, text, right_margin, group, name):
+        x = self.page_width - self._text_width(text, group, name) - right_margin
+        self._draw_text(c, x, y, text, group, name)
+
+    def _draw_page_number(self, c, page_number, overall_total):
+        pos = self.pos_config["detail"]["page_number"]
+        self._draw_text(
+            c, pos["x"], pos["y"], f"Page {page_number}/{overall_total}", "regular", "small"
+        )
+
+    def _draw_overview_page(self, c, bill_data, store_info):
+        c.doForm(self._form_name("overview"))
+        pos_config = self.pos_config["overview"]
+
+        def measure(line):
+            return self._text_width(line, "regular", "small")
+
+        # 商户名称最大宽度500，地址最大宽度1000，时间段固定两行
+        pos = pos_config["store_name"]
+        self._draw_multiline(
+            c, pos["x"], pos["y"], wrap_words(store_info["name"], measure, 500), "regular", "small"
+        )
+        pos = pos_config["time_period"]
+        self._draw_multiline(
+            c,
+            pos["x"],
+            pos["y"],
+            [
+                bill_data["start_date"].strftime("%B %d, %Y"),
+                bill_data["end_date"].strftime("%B %d, %Y"),
+            ],
+            "regular",
+            "small",
+        )
+        pos = pos_config["store_address"]
+        self._draw_multiline(
+            c, pos["x"], pos["y"], wrap_words(store_info["address"], measure, 1000), "regular", "small"
+        )
+
+        for key, text, size in overview_fields(bill_data):
+            pos = pos_config[key]
+            self._draw_text(c, pos["x"], pos["y"], text, "regular", size)
+
+    def _draw_detail_page(self, c, bill_data, store_info, page_orders):
+        c.doForm("detail_background")
+        pos_config = self.pos_config["detail"]
+
+        y_pos = pos_config["order_start_y"]
+        y_increment = pos_config["order_y_increment"]
+        for i, order in enumerate(page_orders):
+            row_y = y_pos + (i * y_increment)
+            for column, text in detail_row_texts(order):
+                self._draw_text(c, pos_config[column]["x"], row_y, text, "roboto", "bold")
+
+    def _draw_additional_page(self, c, bill_data, store_info):
+        c.doForm(self._form_name("additional"))
+        pos_config = self.pos_config["additional"]
+        # 右侧保留50像素边距
+        self._draw_right_aligned(
+            c, pos_config["merchant_name"]["y"], store_info["name"], 50, "regular", "small"
+        )
+        self._draw_right_aligned(
+            c, pos_config["time_period"]["y"], time_period_text(bill_data), 50, "regular", "small"
+        )
+
+        base_y = pos_config["row_start_y"]
+        increment = pos_config["row_y_increment"]
+        for i, (fee_key, name, amount, date_text) in enumerate(additional_rows(bill_data)):
+            row_y = base_y + (i * increment)
+            fee_pos = pos_config[fee_key]
+            for column, text in (("name", name), ("amount", amount), ("date", date_text)):
+                self._draw_text(c, fee_pos[column]["x"], row_y, text, "roboto", "bold")